@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Distribution check of the 2-D samplers used to spawn agents over reward maps
+(inverse_transform_sampling_2d in drl/ac/utils.py). Samples of both the
+inverse CDF and the alias method are binned into map cells and compared with
+the exact cell probabilities using a chi-square statistic, and must be
+uniform inside cells. Also reports time per batch of
+inverse_transform_sampling_2d (tables cached by MapSampler) against building
+tables every call. Run it from the repository root:
+
+    python -m benchmarks.check_sampling
+
+Exits with status 1 if any check fails.
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+tf.flags.DEFINE_integer("check-samples", 1000000, "Number of samples per sampler")
+tf.flags.DEFINE_integer("check-seed", 0, "Random seed of map and samples")
+
+from drl.ac.utils import (
+    AttrDict, build_cdf_tables, sample_cdf_tables, build_alias_table,
+    sample_alias_table, inverse_transform_sampling_2d
+)
+
+FLAGS = tf.flags.FLAGS
+
+SAMPLERS = [
+    ("cdf", build_cdf_tables, sample_cdf_tables),
+    ("alias", build_alias_table, sample_alias_table),
+]
+
+def random_map(rng, M=40, N=60):
+    # Skewed density with empty rows and columns, like reward maps
+    data = rng.rand(M, N) ** 4
+    data[5:9, :] = 0
+    data[:, 10:13] = 0
+    return data
+
+def check(data, xs, ys):
+    M, N = data.shape
+    n = len(xs)
+    p = (data / np.sum(data)).ravel()
+
+    counts = np.histogram2d(ys, xs, bins=[M, N], range=[[0, M], [0, N]])[0].ravel()
+
+    # Chi-square over cells with mass, with ~5 sigma margin
+    nz = p > 0
+    dof = np.count_nonzero(nz) - 1
+    chi2 = np.sum((counts[nz] - n * p[nz]) ** 2 / (n * p[nz]))
+
+    # Fractional parts are uniform inside cells
+    frac = np.histogram(np.concatenate([xs % 1, ys % 1]), bins=10, range=[0, 1])[0]
+    frac_chi2 = np.sum((frac - 0.2 * n) ** 2 / (0.2 * n))
+
+    return AttrDict(
+        in_bounds = np.all((xs >= 0) & (xs <= N) & (ys >= 0) & (ys <= M)),
+        zero_mass_hits = int(np.sum(counts[~nz])),
+        chi2_ok = chi2 < dof + 5 * np.sqrt(2 * dof),
+        chi2 = chi2 / dof,
+        uniform_ok = frac_chi2 < 9 + 5 * np.sqrt(2 * 9),
+    )
+
+def time_per_batch(fn, batch_size=16, repeats=1000):
+    t = time.time()
+    for i in range(repeats):
+        fn(batch_size)
+    return (time.time() - t) / repeats * 1e6
+
+def main():
+    np.random.seed(FLAGS.check_seed)
+    data = random_map(np.random.RandomState(FLAGS.check_seed))
+
+    failed = False
+    for name, build, sample in SAMPLERS:
+        tables = build(data)
+        xs, ys = sample(tables, FLAGS.check_samples)
+        r = check(data, xs, ys)
+
+        ok = r.in_bounds and r.zero_mass_hits == 0 and r.chi2_ok and r.uniform_ok
+        failed |= not ok
+
+        # Building tables every call vs. what resets pay, i.e. hashing the
+        # map to look up the cached sampler then sampling
+        uncached = time_per_batch(lambda n: sample(build(data), n), repeats=10)
+        cached = time_per_batch(
+            lambda n: inverse_transform_sampling_2d(data, n, name, map_def="check"))
+
+        print "{:6s} chi2/dof = {:.3f}, zero-mass hits = {}, in bounds = {}, uniform in cells = {}, {:.1f} us (uncached {:.1f} us) per batch of 16 [{}]".format(
+            name, r.chi2, r.zero_mass_hits, r.in_bounds, r.uniform_ok,
+            cached, uncached, "OK" if ok else "FAILED")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
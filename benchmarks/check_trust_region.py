@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Gradient check of the closed-form KL and d(KL)/d(phi) used by the TRPO
+projection (drl/ac/trust_region.py), against tf.gradients and
+tf.contrib.distributions.kl. GMM uses a closed-form upper bound of KL, only
+its gradient is checked. Run it from the repository root:
+
+    python -m benchmarks.check_trust_region
+
+Exits with status 1 if any error exceeds --check-tolerance.
+"""
+import sys
+import numpy as np
+import tensorflow as tf
+
+tf.flags.DEFINE_float("check-tolerance", 1e-6, "Max absolute error allowed")
+tf.flags.DEFINE_integer("check-seed", 0, "Random seed of distribution parameters")
+
+from drl.ac.utils import AttrDict
+from drl.ac.distributions import DISTRIBUTIONS
+from drl.ac.trust_region import check_kl_grads
+
+FLAGS = tf.flags.FLAGS
+
+# [seq_length, batch_size, num_actions], and number of GMM components
+SHAPE = (5, 3, 2)
+K = 3
+
+def random_params(dist_type, rng):
+    if dist_type == "normal":
+        return rng.randn(*SHAPE), rng.uniform(0.1, 2., SHAPE)
+    elif dist_type == "beta":
+        return rng.uniform(2., 10., SHAPE), rng.uniform(2., 10., SHAPE)
+    else:
+        shape = SHAPE[:-1] + (K * SHAPE[-1],)
+        return rng.randn(*shape), rng.uniform(0.1, 2., shape), rng.randn(*SHAPE[:-1] + (K,))
+
+def make_pi(dist_type, rng):
+
+    phi = [tf.constant(p, tf.float64) for p in random_params(dist_type, rng)]
+
+    return AttrDict(
+        phi = phi,
+        dist = DISTRIBUTIONS[dist_type](*phi) if dist_type in DISTRIBUTIONS else None,
+        dist_type = dist_type
+    )
+
+def main():
+    rng = np.random.RandomState(FLAGS.check_seed)
+
+    checks = []
+    for dist_type in ["normal", "beta", "gmm"]:
+        pi_avg, pi = make_pi(dist_type, rng), make_pi(dist_type, rng)
+        checks.append((dist_type, check_kl_grads(pi_avg, pi)))
+
+    with tf.Session() as sess:
+        results = sess.run([c for _, c in checks])
+
+    failed = False
+    for (dist_type, _), errors in zip(checks, results):
+        ok = max(errors.values()) <= FLAGS.check_tolerance
+        failed |= not ok
+        print "{:8s} {} [{}]".format(dist_type, ", ".join([
+            "max |{} error| = {:.3e}".format(k, v) for k, v in sorted(errors.items())
+        ]), "OK" if ok else "FAILED")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
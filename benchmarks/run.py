@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Offline CPU benchmarks for the rollout, replay, update and parameter sync hot
+paths. No MuJoCo or OffRoadNav is needed, a stub continuous-control env is
+used instead. Run it from the repository root:
+
+    python -m benchmarks.run --bench-seq-lengths 16,64 --bench-hidden-sizes 64
+
+Results are written as JSON to --bench-output so that numbers can be compared
+between releases. To compare per-update time of the policy heads:
+
+    python -m benchmarks.run --bench-policy-heads Gaussian,GMM,StudentT --bench-parallelism 1
+"""
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import itertools
+import numpy as np
+import tensorflow as tf
+
+tf.flags.DEFINE_string("bench-estimators", "ACER,A3C", "Comma separated estimator types to benchmark")
+tf.flags.DEFINE_string("bench-parallelism", "1,2,4", "Comma separated number of workers for parameter sync benchmark")
+tf.flags.DEFINE_string("bench-seq-lengths", "16,64,256", "Comma separated sequence lengths")
+tf.flags.DEFINE_string("bench-hidden-sizes", "64,128", "Comma separated hidden sizes")
+tf.flags.DEFINE_string("bench-policy-heads", None, "Comma separated policy heads (Gaussian, GMM, StudentT or Beta) to benchmark. Defaults to the one of --policy-dist and --mixture-model")
+tf.flags.DEFINE_integer("bench-repeats", 10, "Number of timed repetitions per measurement")
+tf.flags.DEFINE_string("bench-output", None, "JSON file to write results to. Defaults to <exp-dir>/benchmark-<timestamp>.json")
+
+from benchmarks.stub_env import STUB_ENV_ID
+
+# drl.config defines the flags, import it before reading any of them. The stub
+# env default has to be in place before parse_flags() derives exp_dir from it
+from drl.config import parse_flags
+
+FLAGS = tf.flags.FLAGS
+if FLAGS.game is None:
+    FLAGS.game = STUB_ENV_ID
+FLAGS.display = False
+
+FLAGS = parse_flags()
+
+import gym
+from drl.ac.estimators import get_estimator
+from drl.ac.acer.estimators import AcerEstimator
+from drl.ac.utils import (
+    AttrDict, EpisodeStats, ReplayBuffer, warm_up_env, mkdir_p,
+    create_global_variables
+)
+warm_up_env()
+
+# policy head -> (--policy-dist, --mixture-model)
+POLICY_HEADS = {
+    "Gaussian": ("Gaussian", False),
+    "GMM": ("Gaussian", True),
+    "StudentT": ("StudentT", False),
+    "Beta": ("Beta", False),
+}
+
+def parse_list(s, type=int):
+    return [type(x) for x in s.split(",") if x.strip()]
+
+def time_calls(fn, repeats):
+    # One untimed call to warm up (allocations, TF kernel selection, ...)
+    fn()
+
+    durations = []
+    for i in range(repeats):
+        t = time.time()
+        fn()
+        durations.append(time.time() - t)
+
+    durations = np.array(durations)
+    return AttrDict(
+        mean_ms = float(np.mean(durations) * 1000),
+        median_ms = float(np.median(durations) * 1000),
+        p90_ms = float(np.percentile(durations, 90) * 1000),
+        repeats = repeats,
+    )
+
+def build_graph(estimator_type, parallelism):
+    """
+    Build global net and workers the same way train.py does, in a fresh graph
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+
+        # average_net is cached on the class, it belongs to the previous graph
+        if "average_net" in AcerEstimator.__dict__:
+            del AcerEstimator.average_net
+
+        create_global_variables()
+
+        Estimator = get_estimator(estimator_type)
+
+        with tf.variable_scope("global_net"):
+            global_net = Estimator(trainable=False)
+
+        global_counter = itertools.count()
+        FLAGS.stats = EpisodeStats()
+
+        workers = [
+            Estimator.Worker(
+                name="worker_%d" % i,
+                env=gym.make(FLAGS.game),
+                global_counter=global_counter,
+                global_episode_stats=FLAGS.stats,
+                global_net=global_net,
+                add_summaries=False,
+                n_agents=1)
+            for i in range(parallelism)
+        ]
+
+        sess = tf.Session(graph=graph)
+        sess.run(tf.global_variables_initializer())
+        graph.finalize()
+
+    for worker in workers:
+        worker.sess = sess
+
+    return AttrDict(graph=graph, sess=sess, workers=workers)
+
+def bench_run_n_steps(worker, seq_length, repeats):
+    t = time_calls(lambda: worker.run_n_steps(seq_length), repeats)
+    t.steps_per_sec = seq_length / (t.mean_ms / 1000.)
+    return t
+
+def bench_update(worker, estimator_type, seq_length, repeats):
+    rollout = worker.run_n_steps(seq_length)
+
+    if estimator_type == "ACER":
+        rollout = worker.get_partial_rollout(rollout)
+        fn = lambda: worker.update(rollout, display=False)
+    else:
+        fn = lambda: worker.update([rollout])
+
+    t = time_calls(fn, repeats)
+    t.updates_per_sec = 1000. / t.mean_ms
+    return t
+
+def bench_replay(worker, seq_length, repeats):
+    rollout = worker.run_n_steps(seq_length)
+
+    results = {}
+    compress = FLAGS.compress
+    for FLAGS.compress in [False, True]:
+        rp = ReplayBuffer(maxlen=FLAGS.max_replay_buffer_size)
+        append = time_calls(lambda: rp.append(rollout), repeats)
+        sample = time_calls(lambda: rp[np.random.randint(len(rp))], repeats)
+        key = "compressed" if FLAGS.compress else "raw"
+        results[key] = AttrDict(append=append, sample=sample)
+    FLAGS.compress = compress
+
+    return results
+
+def bench_copy_params(workers, sess, repeats):
+    """
+    All workers sync their local net from the global net concurrently, just
+    like they do at the beginning of every cycle in training
+    """
+    # Latency of each sync as seen by the worker running it
+    latencies = []
+
+    def sync(worker):
+        for i in range(repeats):
+            t = time.time()
+            sess.run(worker.copy_params_op)
+            latencies.append(time.time() - t)
+
+    # warm up
+    for worker in workers:
+        sess.run(worker.copy_params_op)
+
+    threads = [threading.Thread(target=sync, args=(w,)) for w in workers]
+
+    t = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - t
+
+    n_syncs = repeats * len(workers)
+    return AttrDict(
+        wall_time_ms = elapsed * 1000,
+        syncs_per_sec = n_syncs / elapsed,
+        mean_sync_ms = np.mean(latencies) * 1000,
+        wall_ms_per_round = elapsed * 1000 / repeats,
+        repeats = repeats,
+    )
+
+def main():
+    estimators = parse_list(FLAGS.bench_estimators, str)
+    parallelisms = parse_list(FLAGS.bench_parallelism)
+    seq_lengths = parse_list(FLAGS.bench_seq_lengths)
+    hidden_sizes = parse_list(FLAGS.bench_hidden_sizes)
+    repeats = FLAGS.bench_repeats
+
+    if FLAGS.bench_policy_heads is None:
+        policy_heads = ["GMM" if FLAGS.mixture_model else FLAGS.policy_dist]
+    else:
+        policy_heads = parse_list(FLAGS.bench_policy_heads, str)
+
+    FLAGS.max_seq_length = max(FLAGS.max_seq_length, max(seq_lengths))
+
+    results = []
+    def record(benchmark, **kwargs):
+        kwargs["benchmark"] = benchmark
+        tf.logging.info(json.dumps(kwargs, sort_keys=True))
+        results.append(kwargs)
+
+    for policy_head, estimator_type, hidden_size in itertools.product(
+            policy_heads, estimators, hidden_sizes):
+        FLAGS.policy_dist, FLAGS.mixture_model = POLICY_HEADS[policy_head]
+        FLAGS.hidden_size = hidden_size
+        config = dict(estimator=estimator_type, hidden_size=hidden_size,
+                      share_local_net=FLAGS.share_local_net,
+                      policy_head=policy_head)
+
+        for parallelism in parallelisms:
+            t = time.time()
+            g = build_graph(estimator_type, parallelism)
+            build_time = time.time() - t
+            record("build_graph", parallelism=parallelism, seconds=build_time,
+                   num_ops=len(g.graph.get_operations()), **config)
+
+            with g.sess.as_default(), g.graph.as_default():
+                # Workers sharing the global net have nothing to copy
+                if not FLAGS.share_local_net:
+                    record("copy_params", parallelism=parallelism,
+                           **dict(bench_copy_params(g.workers, g.sess, repeats), **config))
+
+                # Single worker hot paths don't depend on parallelism
+                if parallelism == parallelisms[0]:
+                    worker = g.workers[0]
+                    for seq_length in seq_lengths:
+                        config["seq_length"] = seq_length
+
+                        record("run_n_steps", **dict(
+                            bench_run_n_steps(worker, seq_length, repeats), **config))
+
+                        record("update", **dict(
+                            bench_update(worker, estimator_type, seq_length, repeats), **config))
+
+                        for mode, r in bench_replay(worker, seq_length, repeats).iteritems():
+                            record("replay_append", mode=mode, **dict(r.append, **config))
+                            record("replay_sample", mode=mode, **dict(r.sample, **config))
+
+                    config.pop("seq_length", None)
+
+            g.sess.close()
+
+    output = FLAGS.bench_output or "{}/benchmark-{}.json".format(
+        FLAGS.exp_dir, int(time.time()))
+    mkdir_p(os.path.dirname(os.path.abspath(output)))
+
+    with open(output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": time.time(),
+                "tensorflow": tf.__version__,
+                "numpy": np.__version__,
+                "python": sys.version,
+                "platform": platform.platform(),
+                "dtype": FLAGS.dtype.name,
+                "use_lstm": FLAGS.use_lstm,
+                "num_mixtures": FLAGS.num_mixtures,
+            },
+            "results": results
+        }, f, indent=2, sort_keys=True)
+
+    tf.logging.info("Benchmark results written to {}".format(output))
+
+if __name__ == "__main__":
+    main()
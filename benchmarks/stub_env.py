@@ -0,0 +1,43 @@
+import gym
+import numpy as np
+from gym import spaces
+from gym.utils import seeding
+from gym.envs.registration import register
+
+STUB_ENV_ID = "StubContinuous-v0"
+
+class StubContinuousEnv(gym.Env):
+    """
+    A cheap continuous-control environment with MuJoCo-like observation and
+    action spaces. It never terminates on its own, so Worker.run_n_steps
+    always runs exactly n_steps and the benchmark controls sequence length.
+    """
+    def __init__(self, num_states=17, num_actions=6):
+        high = np.inf * np.ones(num_states)
+        self.observation_space = spaces.Box(-high, high)
+        self.action_space = spaces.Box(-np.ones(num_actions), np.ones(num_actions))
+        self.num_states = num_states
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def reset(self):
+        self.state = self.np_random.randn(self.num_states).astype(np.float32)
+        return self.state
+
+    def step(self, action):
+        action = np.clip(action, self.action_space.low, self.action_space.high)
+        noise = 0.01 * self.np_random.randn(self.num_states)
+        self.state = (0.99 * self.state + noise).astype(np.float32)
+        reward = -float(np.sum(np.square(action)))
+        return self.state, reward, False, {}
+
+    def render(self, mode='human', close=False):
+        pass
+
+    def close(self):
+        pass
+
+register(id=STUB_ENV_ID, entry_point="benchmarks.stub_env:StubContinuousEnv")
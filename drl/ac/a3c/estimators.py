@@ -15,27 +15,39 @@ class A3CEstimator():
 
     def __init__(self, add_summaries=False, trainable=True):
 
+        scope_name = tf.get_variable_scope().name + '/'
+
         with tf.name_scope("inputs"):
+            # We feed seq_length + 1 states, the last one is only used to
+            # bootstrap the value. seq_length is fed 1 when predicting actions
+            self.seq_length = tf.placeholder(tf.int32, [], "seq_length")
             self.state = get_state_placeholder()
-
-        with tf.name_scope("outputs"):
-            self.advantages  = tf.placeholder(FLAGS.dtype, [seq_length, batch_size, 1], "advantages")
-            self.returns     = tf.placeholder(FLAGS.dtype, [seq_length, batch_size, 1], "returns")
             self.actions_ext = tf.placeholder(FLAGS.dtype, [seq_length, batch_size, FLAGS.num_actions], "actions_ext")
+            self.r = tf.placeholder(FLAGS.dtype, [seq_length, batch_size, 1], "rewards")
+            self.done = tf.placeholder(tf.bool, [seq_length, batch_size, 1], "done")
 
         with tf.variable_scope("shared"):
-            shared, self.lstm = build_network(self.state, add_summaries=add_summaries)
+            shared, self.lstm = build_network(self.state, scope_name, add_summaries)
             shared = tf_check_numerics(shared)
 
+        self.state.update(self.lstm.inputs)
+
+        with tf.name_scope("state_value_network"):
+            self.value_all = state_value_network(shared)
+            self.value_last = self.value_all[-1:, ...]
+            self.value = self.value_all[:self.seq_length, ...]
+
         with tf.name_scope("policy"):
-            self.pi, _ = build_policy(shared, FLAGS.policy_dist)
+            self.pi, _ = build_policy(shared[:self.seq_length, ...], FLAGS.policy_dist)
             actions = tf.squeeze(self.pi.sample_n(1), 0)
             self.actions = tf_print(actions)
 
             self.action_and_stats = [self.actions, self.pi.stats]
 
-        with tf.name_scope("state_value_network"):
-            self.value = state_value_network(shared)
+        with tf.name_scope("returns_and_advantages"):
+            self.returns, self.advantages = self.compute_returns_and_advantages(
+                self.r, self.done, self.value, self.value_last
+            )
 
         with tf.name_scope("losses"):
             self.pi_loss = self.get_policy_loss(self.pi)
@@ -57,7 +69,7 @@ class A3CEstimator():
             self.loss += FLAGS.l2_reg * self.reg_loss
 
         with tf.name_scope("grads_and_optimizer"):
-            self.optimizer = tf.train.RMSPropOptimizer(FLAGS.learning_rate)
+            self.optimizer = tf.train.RMSPropOptimizer(FLAGS.learning_rate_var)
             grads_and_vars = self.optimizer.compute_gradients(self.loss)
             check_none_grads(grads_and_vars)
             self.grads_and_vars = [(g, v) for g, v in grads_and_vars if g is not None]
@@ -67,6 +79,46 @@ class A3CEstimator():
 
         self.summaries = self.summarize(add_summaries)
 
+    def compute_returns_and_advantages(self, r, done, values, value_last):
+        """
+        Use tf.scan to compute discounted returns and Generalized Advantage
+        Estimation (GAE) backward in time, so that value prediction and the
+        training step share a single forward pass
+        """
+        gamma = tf_const(FLAGS.discount_factor)
+        lambda_ = tf_const(FLAGS.lambda_)
+
+        # Once a sequence terminates at step t, nothing after t is propagated
+        not_done = 1. - tf.cast(done, FLAGS.dtype)
+
+        with tf.name_scope("initial_value"):
+            R_0 = value_last[0] * int(FLAGS.bootstrap)
+            A_0 = tf.zeros_like(R_0)
+
+        # 1-step TD error, V(s_{t+1}) is masked out for terminal steps
+        with tf.name_scope("td_error"):
+            next_values = tf.concat([values[1:], value_last * int(FLAGS.bootstrap)], 0)
+            deltas = r + gamma * next_values * not_done - values
+
+        def step(acc, x):
+            R, A = acc
+            r_t, delta_t, not_done_t = x
+            R = r_t + gamma * not_done_t * R
+            A = delta_t + gamma * lambda_ * not_done_t * A
+            return R, A
+
+        reverse = lambda x: tf.reverse(x, [0])
+
+        returns, advantages = tf.scan(
+            step, (reverse(r), reverse(deltas), reverse(not_done)),
+            initializer=(R_0, A_0)
+        )
+
+        returns = tf.stop_gradient(reverse(returns), name="returns")
+        advantages = tf.stop_gradient(reverse(advantages), name="advantages")
+
+        return returns, advantages
+
     def get_policy_loss(self, pi):
         # policy loss is the negative of log_prob times advantages
         with tf.name_scope("policy_loss"):
@@ -98,40 +150,42 @@ class A3CEstimator():
         return reg_losses
 
     def to_feed_dict(self, state):
-        rank_a = len(self.state.prev_reward.get_shape())
-        rank_b = state.prev_reward.ndim
 
         feed_dict = {
-            self.state[k]: state[k] if rank_a == rank_b else state[k][None, ...]
+            self.state[k]: state[k]
+            if same_rank(self.state[k], state[k]) else state[k][None, ...]
             for k in state.keys()
         }
 
         return feed_dict
 
-    def reset_lstm_state(self):
-        self.lstm.prev_state_out = None
+    def get_initial_hidden_states(self, batch_size):
+        return get_lstm_initial_states(self.lstm.inputs, batch_size)
 
-    def predict(self, tensors, feed_dict, sess=None):
+    def predict(self, tensors, feed_dict, sess=None, **kwargs):
         sess = sess or tf.get_default_session()
 
-        B = feed_dict[self.state.prev_reward].shape[1]
-        fill_lstm_state_placeholder(self.lstm, feed_dict, B)
-
-        output, self.lstm.prev_state_out = sess.run([
-            tensors, self.lstm.state_out
-        ], feed_dict)
+        output, hidden_states = sess.run([
+            tensors, self.lstm.outputs
+        ], feed_dict, **kwargs)
 
-        return output
+        return output, hidden_states
 
     def predict_values(self, state, sess=None):
         feed_dict = self.to_feed_dict(state)
-        return self.predict(self.value, feed_dict, sess)
+        feed_dict[self.seq_length] = feed_dict[self.state.prev_reward].shape[0]
+        values, _ = self.predict(self.value_all, feed_dict, sess)
+        return values
 
     def predict_actions(self, state, sess=None):
         feed_dict = self.to_feed_dict(state)
-        actions, stats = self.predict(self.action_and_stats, feed_dict, sess)
+        feed_dict[self.seq_length] = 1
+
+        (actions, stats), hidden_states = self.predict(self.action_and_stats, feed_dict, sess)
+
         actions = actions[0, ...].T
-        return actions, stats
+
+        return actions, stats, hidden_states
 
     def summarize(self, add_summaries):
         return tf.no_op()
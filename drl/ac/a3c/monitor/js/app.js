@@ -158,22 +158,73 @@ function draw_all() {
   }); */
 }
 
+const TYPED_ARRAYS = {
+  'float32': Float32Array, 'float64': Float64Array, 'int32': Int32Array,
+  'int16': Int16Array, 'int8': Int8Array, 'uint8': Uint8Array,
+  'uint16': Uint16Array, 'uint32': Uint32Array
+};
+
+// Turn flat typed array into nested arrays of given shape
+function to_nested(flat, shape, offset) {
+  offset = offset || 0;
+  if (shape.length == 0)
+    return flat[offset];
+
+  var stride = shape.slice(1).reduce(function (a, b) { return a * b; }, 1);
+  var out = [];
+  for (var i=0; i<shape[0]; ++i)
+    out.push(to_nested(flat, shape.slice(1), offset + i * stride));
+  return out;
+}
+
+// Fetch field as raw bytes, shape and dtype are in response headers
+function request_field(field, callback) {
+  var xhr = new XMLHttpRequest();
+  xhr.open("GET", "/data/bin/" + field);
+  xhr.responseType = "arraybuffer";
+  xhr.onload = function () {
+    if (xhr.status == 200) {
+      var shape = xhr.getResponseHeader("X-Shape").split(",").filter(function (s) {
+	return s.length > 0;
+      }).map(Number);
+      var flat = new TYPED_ARRAYS[xhr.getResponseHeader("X-Dtype")](xhr.response);
+      data[field] = to_nested(flat, shape);
+    }
+    callback();
+  };
+  xhr.send();
+}
+
 function request_data(callback) {
-  var semaphore = 0;
-
-  for (var i=0; i<fields.length; ++i) {
-    semaphore += 1;
-    $.get("/data/" + fields[i], (function(field) {
-      return function (res) {
-	data[field] = JSON.parse(res);
-	semaphore -= 1;
-
-	if (semaphore == 0)
-	  callback();
-      };
-    })(fields[i]));
-  }
+  var semaphore = fields.length;
 
+  fields.forEach(function (field) {
+    request_field(field, function () {
+      semaphore -= 1;
+      if (semaphore == 0)
+	callback();
+    });
+  });
+}
+
+// Re-fetch only the fields that changed, and redraw once they've all arrived
+function subscribe() {
+  var pending = 0;
+
+  new EventSource("/events").addEventListener("update", function (event) {
+    var field = JSON.parse(event.data).field;
+    if (fields.indexOf(field) < 0)
+      return;
+
+    pending += 1;
+    request_field(field, function () {
+      pending -= 1;
+      if (pending == 0) {
+	Snap(".canvas").selectAll(".agent").remove();
+	draw_all();
+      }
+    });
+  });
 }
 
 function main() {
@@ -195,4 +246,7 @@ function main() {
   });
 }
 
-request_data(main);
+request_data(function () {
+  main();
+  subscribe();
+});
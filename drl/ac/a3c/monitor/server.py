@@ -1,20 +1,112 @@
 import json
+import threading
 import numpy as np
-from flask import Flask, send_from_directory
+from flask import Flask, Response, request, send_from_directory
 
 app = Flask(__name__, static_url_path='')
 
+# field -> (version, value). Encodings are computed lazily, at most once per
+# version and format, and only if somebody asks for them
 data = {}
+encoded = {}
+version = [0]
+
+# Notifies /events streams when any field is set
+changed = threading.Condition()
+
+# Fields rendered as images, they're rescaled to [0, 255]
+IMAGE_FIELDS = ["front_view"]
 
 def set_data(field, value):
-    print "{} were set".format(field)
-    if field == "front_view":
-        value_range = np.max(value) - np.min(value)
-        if value_range != 0:
-            value = (value - np.min(value)) / value_range * 255.
-        value = np.clip(value, 0, 255).astype(np.uint8)
+    # Called from the training loop, keep it cheap: no conversion here
+    with changed:
+        version[0] += 1
+        data[field] = (version[0], value)
+        changed.notify_all()
+
+def to_uint8(value):
+    value_range = np.max(value) - np.min(value)
+    if value_range != 0:
+        value = (value - np.min(value)) / value_range * 255.
+    return np.clip(value, 0, 255).astype(np.uint8)
+
+def to_wire(field, value):
+    value = np.asarray(value)
+
+    if field in IMAGE_FIELDS:
+        return to_uint8(value)
+
+    # JavaScript has no typed arrays for these
+    if value.dtype == np.bool_:
+        return value.astype(np.uint8)
+    if value.dtype.kind in 'iu' and value.dtype.itemsize == 8:
+        return value.astype(np.float64)
+
+    return np.ascontiguousarray(value)
+
+def to_png(value):
+    import cv2
+
+    # Stack leading axes vertically, X-Shape tells how to split them back
+    if value.ndim > 2:
+        value = value.reshape((-1,) + value.shape[-2:])
+        if value.shape[-1] not in [1, 3, 4]:
+            value = value.reshape(-1, value.shape[-1])
+
+    ok, png = cv2.imencode(".png", value)
+    if not ok:
+        raise ValueError("Can't encode {} array of shape {} as png".format(
+            value.dtype, value.shape))
+    return png.tostring()
+
+ENCODERS = {
+    "json": ("application/json", lambda v: json.dumps(v.tolist())),
+    "bin": ("application/octet-stream", lambda v: v.tostring()),
+    "png": ("image/png", to_png),
+}
+
+def get_encoded(field, fmt, v, value):
+    # Handlers run in threads. Encoding is done outside the lock, so neither
+    # set_data nor other requests wait for it
+    key = (field, fmt)
+    with changed:
+        cached = encoded.get(key)
+    if cached is not None and cached[0] == v:
+        return cached
 
-    data[field] = value
+    value = to_wire(field, value)
+    mimetype, encode = ENCODERS[fmt]
+    cached = (v, value.shape, value.dtype, mimetype, encode(value))
+
+    with changed:
+        # Don't overwrite a newer version encoded meanwhile
+        if key not in encoded or encoded[key][0] < v:
+            encoded[key] = cached
+
+    return cached
+
+def send_field(field, fmt):
+    with changed:
+        if field not in data:
+            return Response("No such field: {}".format(field), status=404)
+        v, value = data[field]
+
+    # Unchanged fields are not resent, nor encoded
+    etag = '"{}-{}"'.format(field, v)
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers={"ETag": etag})
+
+    try:
+        v, shape, dtype, mimetype, body = get_encoded(field, fmt, v, value)
+    except ValueError as e:
+        return Response(str(e), status=500)
+
+    return Response(body, mimetype=mimetype, headers={
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Shape": ",".join(map(str, shape)),
+        "X-Dtype": str(dtype),
+    })
 
 @app.route('/')
 def index():
@@ -30,7 +122,45 @@ def send_js(path):
 
 @app.route("/data/<field_name>")
 def getdata(field_name):
-    return json.dumps(data[field_name].tolist())
+    return send_field(field_name, "json")
+
+@app.route("/data/<fmt>/<field_name>")
+def getdata_as(fmt, field_name):
+    if fmt not in ENCODERS:
+        return Response("Unknown format: {}".format(fmt), status=404)
+    return send_field(field_name, fmt)
+
+@app.route("/versions")
+def versions():
+    with changed:
+        versions = {k: v for k, (v, _) in data.items()}
+    return json.dumps(versions)
+
+@app.route("/events")
+def events():
+    """
+    Server-sent events, one "update" event per field set since last event
+    """
+    def stream(last):
+        while True:
+            with changed:
+                while version[0] == last:
+                    changed.wait(timeout=15)
+                    if version[0] == last:
+                        # Keep connection alive through proxies
+                        break
+                updates = {k: v for k, (v, _) in data.items() if v > last}
+                last = version[0]
+
+            if len(updates) == 0:
+                yield ": keep-alive\n\n"
+
+            for field, v in updates.items():
+                yield "event: update\ndata: {}\n\n".format(
+                    json.dumps({"field": field, "version": v}))
+
+    return Response(stream(version[0]), mimetype="text/event-stream")
 
 def start():
-    app.run()
+    # /events holds a connection per client, so serve requests in threads
+    app.run(threaded=True)
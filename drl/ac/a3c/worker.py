@@ -1,11 +1,11 @@
 import numpy as np
 import tensorflow as tf
-import scipy.io
 import traceback
 import time
 import drl.ac.a3c.estimators
 from drl.ac.worker import Worker
 from drl.ac.utils import *
+from drl.logger import log_every_n_seconds
 
 FLAGS = tf.flags.FLAGS
 
@@ -25,15 +25,17 @@ class A3CWorker(Worker):
         super(A3CWorker, self).__init__(**kwargs)
 
     def set_global_net(self, global_net):
-        global_vars = global_net.var_list
-        local_vars = self.local_net.var_list
-        self.copy_params_op = make_copy_params_op(global_vars, local_vars)
+        self.copy_params_op = self.build_copy_params_op(global_net)
 
         self.global_net = global_net
         self.gstep = 0
 
-        self.train_op = make_train_op(self.local_net, self.global_net)
-        self.inc_global_step = tf.assign_add(self.global_step, 1)
+        def build_train_ops():
+            train_op = make_train_op(self.local_net, self.global_net)
+            inc_global_step = tf.assign_add(self.global_step, 1)
+            return train_op, inc_global_step
+
+        self.train_op, self.inc_global_step = self.shared_op("train", build_train_ops)
 
         net = self.local_net
         self.step_op = [
@@ -51,27 +53,41 @@ class A3CWorker(Worker):
     def _run(self):
         self.copy_params_from_global()
 
-        # FLAGS.max_steps = int(np.ceil(FLAGS.t_max * FLAGS.command_freq))
-        rollout = self.run_n_steps(FLAGS.max_steps)
+        # Collect --on-policy-batch-size rollouts with the same parameters,
+        # they are batched into one update
+        rollouts = []
+        for i in range(FLAGS.on_policy_batch_size):
+            # FLAGS.max_steps = int(np.ceil(FLAGS.t_max * FLAGS.command_freq))
+            with self.profiler.span("rollout"):
+                rollout = self.run_n_steps(FLAGS.max_steps)
+
+            # Even though A3C can't use experience replay, we still need store
+            # experiences for playback visualization and statistics
+            self.store_experience(rollout)
 
-        # Even though A3C can't use experience replay, we still need store
-        # experiences for playback visualization and statistics
-        self.store_experience(rollout)
+            rollouts.append(rollout)
 
         # Update the global networks
-        self.update(rollout)
+        with self.profiler.span("update"):
+            self.update(rollouts)
 
         """
         mean, std, msg = self.global_episode_stats.last_n_stats()
         tf.logging.info("\33[93m" + msg + "\33[0m")
         """
 
-    def update(self, rollout):
+    def update(self, rollouts):
 
-        if rollout.seq_length == 0:
+        rollouts = [r for r in rollouts if r.seq_length > 0]
+        if not rollouts:
             return
 
-        rollout = self.get_partial_rollout(rollout, FLAGS.max_seq_length)
+        # Slice all rollouts to a common length and stack them along the batch
+        # axis. Sequences may terminate at different steps, returns and GAE
+        # are masked by per-sequence done in the graph
+        length = min([r.seq_length for r in rollouts] + [FLAGS.max_seq_length])
+        rollouts = [self.get_partial_rollout(r, length) for r in rollouts]
+        rollout = rollouts[0] if len(rollouts) == 1 else self.batch_rollouts(rollouts)
 
         """
         print "rollout.keys = {}".format(rollout.keys())
@@ -80,38 +96,31 @@ class A3CWorker(Worker):
         """
 
         net = self.local_net
-        net.reset_lstm_state()
-        gamma = self.discount_factor
-
-        # Compute values and bootstrap from last state if not terminal (~done)
-        # tf.logging.info("rollout.seq_length = {}, rollout.states.keys() = {}".format(rollout.seq_length, rollout.states.keys()))
-        values = net.predict_values(rollout.states, self.sess)
-        values[-1, rollout.done[-1]] = 0
-
-        # Compute discounted total returns from rewards and values[-1]
-        returns = discount(np.vstack([rollout.reward, values[-1:]]), gamma)[:-1]
-
-        # Compute 1-step TD target
-        delta_t = rollout.reward + gamma * values[1:] - values[:-1]
-
-        # Compute Generalized Advantage Estimation (GAE) from 1-step TD target
-        advantages = discount(delta_t, gamma * FLAGS.lambda_)
-
-        # Fill feed_dict with values we just computed
-        feed_dict = {
-            net.advantages: advantages,
-            net.returns: returns,
-            net.actions_ext: rollout.action,
-        }
-        feed_dict.update({net.state[k]: v[:-1] for k, v in rollout.states.iteritems()})
-
-        # Reset LSTM state and update
-        net.reset_lstm_state()
-        loss, summaries, _, self.gstep = net.predict(self.step_op, feed_dict, self.sess)
+
+        # Bootstrap values, returns and GAE are all computed inside the graph,
+        # so a single sess.run does the forward pass once and applies gradients
+        with self.profiler.span("feed_dict"):
+            feed_dict = {
+                net.r: rollout.reward,
+                net.done: rollout.done,
+                net.actions_ext: rollout.action,
+                net.seq_length: rollout.seq_length,
+            }
+            feed_dict.update({net.state[k]: v for k, v in rollout.states.iteritems()})
+
+        trace = self.tracer.should_trace(self.gstep + 1)
+        run_kwargs = self.tracer.run_kwargs() if trace else {}
+
+        with self.profiler.span("sess_run"):
+            (loss, summaries, _, self.gstep), _ = net.predict(
+                self.step_op, feed_dict, self.sess, **run_kwargs)
+
+        if trace:
+            self.tracer.dump(run_kwargs['run_metadata'], self.gstep)
         loss = AttrDict(loss)
 
-        tf.logging.info(pretty_float(
+        log_every_n_seconds(tf.logging.INFO, lambda: pretty_float(
             "#{:6d}: pi_loss = %f, vf_loss = %f, entropy_loss = %f, total = %f [S = {}]"
         ).format(
             self.gstep, loss.pi, loss.vf, loss.entropy, loss.total, rollout.seq_length
-        ))
+        ), FLAGS.log_update_every_n_seconds, key=self.name)
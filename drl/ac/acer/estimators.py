@@ -151,7 +151,7 @@ class AcerEstimator():
                 global_step = FLAGS.global_step
 
                 self.lr = tf.train.exponential_decay(
-                    tf_const(FLAGS.learning_rate), FLAGS.global_timestep,
+                    FLAGS.learning_rate_var, FLAGS.global_timestep,
                     FLAGS.decay_steps, FLAGS.decay_rate, staircase=FLAGS.staircase
                 )
 
@@ -180,20 +180,25 @@ class AcerEstimator():
         self.summaries = self.summarize(add_summaries)
 
     def compute_rho(self, a, a_prime, pi, pi_behavior):
-        # compute rho, rho_prime, and c
-        with tf.name_scope("pi_a"):
-            self.pi_a = pi_a = pi.prob(a, "In pi_a: ")[..., None]
-        with tf.name_scope("pi_behavior_a"):
-            self.mu_a = mu_a = pi_behavior.prob(a, "In mu_a: ")[..., None]
-
-        with tf.name_scope("pi_a_prime"):
-            self.pi_a_prime = pi_a_prime = pi.prob(a_prime, "In pi_a_prime: ")[..., None]
-        with tf.name_scope("pi_behavior_a_prime"):
-            self.mu_a_prime = mu_a_prime = pi_behavior.prob(a_prime, "In mu_a_prime: ")[..., None]
-
-        # use tf.div instead of pi_a / mu_a to assign a name to the output
-        rho = tf.div(pi_a, mu_a)
-        rho_prime = tf.div(pi_a_prime, mu_a_prime)
+        # compute rho, rho_prime, and c. log-densities of a and a_prime are
+        # evaluated in one op per distribution, and log pi(a), log pi(a') are
+        # reused (from cache) by the policy loss
+        with tf.name_scope("log_pi"):
+            log_pi_a, log_pi_a_prime = pi.log_probs([a, a_prime])
+            log_pi_a, log_pi_a_prime = log_pi_a[..., None], log_pi_a_prime[..., None]
+        with tf.name_scope("log_pi_behavior"):
+            log_mu_a, log_mu_a_prime = pi_behavior.log_probs([a, a_prime])
+            log_mu_a, log_mu_a_prime = log_mu_a[..., None], log_mu_a_prime[..., None]
+
+        # Only for debugging and logging
+        self.pi_a = pi_a = tf.exp(log_pi_a)
+        self.mu_a = mu_a = tf.exp(log_mu_a)
+        self.pi_a_prime = pi_a_prime = tf.exp(log_pi_a_prime)
+        self.mu_a_prime = mu_a_prime = tf.exp(log_mu_a_prime)
+
+        # pi / mu = exp(log pi - log mu), which doesn't underflow
+        rho = tf.exp(log_pi_a - log_mu_a)
+        rho_prime = tf.exp(log_pi_a_prime - log_mu_a_prime)
 
         rho = tf_print(rho)
         rho_prime = tf_print(rho_prime)
@@ -216,8 +221,15 @@ class AcerEstimator():
         """
 
         tf.logging.info("Compute Q_ret & Q_opc recursively ...")
-        gamma = tf_const(FLAGS.discount_factor)
-        lambda_ = tf_const(FLAGS.lambda_)
+
+        # Errors accumulate over the whole sequence, do it in accumulate_dtype
+        dtype = FLAGS.accumulate_dtype
+        values, value_last, c, r, Q_tilt_a = [
+            tf.cast(x, dtype) for x in [values, value_last, c, r, Q_tilt_a]
+        ]
+
+        gamma = tf.constant(FLAGS.discount_factor, dtype)
+        lambda_ = tf.constant(FLAGS.lambda_, dtype)
         # gamma = tf_print(gamma, "gamma = ")
 
         with tf.name_scope("initial_value"):
@@ -278,8 +290,8 @@ class AcerEstimator():
             ]
         )
 
-        Q_ret = tf.stop_gradient(Q_ret[:-1, ...], name="Q_ret")
-        Q_opc = tf.stop_gradient(Q_opc[:-1, ...], name="Q_opc")
+        Q_ret = tf.stop_gradient(tf.cast(Q_ret[:-1, ...], FLAGS.dtype), name="Q_ret")
+        Q_opc = tf.stop_gradient(tf.cast(Q_opc[:-1, ...], FLAGS.dtype), name="Q_opc")
 
         return Q_ret, Q_opc
 
@@ -296,25 +308,23 @@ class AcerEstimator():
     def get_initial_hidden_states(self, batch_size):
         return get_lstm_initial_states(self.lstm.inputs, batch_size)
 
-    def predict(self, tensors, feed_dict, sess=None):
+    def predict(self, tensors, feed_dict, sess=None, **kwargs):
         sess = sess or tf.get_default_session()
 
-        B = feed_dict[self.state.prev_reward].shape[1]
-
         output, hidden_states = sess.run([
             tensors, self.lstm.outputs
-        ], feed_dict)
+        ], feed_dict, **kwargs)
 
         return output, hidden_states
 
-    def update(self, tensors, feed_dict, sess=None):
+    def update(self, tensors, feed_dict, sess=None, **kwargs):
         sess = sess or tf.get_default_session()
 
         # avg_net is shared by all workers, we need to use lock to make sure
         # avg_net.LSTM states won't be changed by other threads before
         # calling sess.run
         with self.avg_net.lock:
-            output, _ = self.predict(tensors, feed_dict, sess)
+            output, _ = self.predict(tensors, feed_dict, sess, **kwargs)
 
         return output
 
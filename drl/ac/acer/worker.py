@@ -25,11 +25,9 @@ class AcerWorker(Worker):
     def set_global_net(self, global_net):
         # Get global, local, and the average net var_list
         avg_vars = self.Estimator.average_net.var_list
-        global_vars = global_net.var_list
-        local_vars = self.local_net.var_list
 
         # Operation to copy params from global net to local net
-        self.copy_params_op = make_copy_params_op(global_vars, local_vars)
+        self.copy_params_op = self.build_copy_params_op(global_net)
 
         self.global_net = global_net
         self.gstep = 0
@@ -37,12 +35,18 @@ class AcerWorker(Worker):
         self.prev_debug = None
         self.prev_mdp_states = None
 
-        train_and_update_avgnet_op = drl.ac.acer.estimators.create_avgnet_init_op(
-            self.global_step, avg_vars, global_net, self.local_net
-        )
+        def build_train_ops():
+            train_and_update_avgnet_op = drl.ac.acer.estimators.create_avgnet_init_op(
+                self.global_step, avg_vars, global_net, self.local_net
+            )
 
-        with tf.control_dependencies([train_and_update_avgnet_op]):
-            self.inc_global_step = tf.assign_add(self.global_step, 1)
+            with tf.control_dependencies([train_and_update_avgnet_op]):
+                inc_global_step = tf.assign_add(self.global_step, 1)
+
+            return train_and_update_avgnet_op, inc_global_step
+
+        train_and_update_avgnet_op, self.inc_global_step = \
+            self.shared_op("train", build_train_ops)
 
         net = self.local_net
         self.step_op = [
@@ -64,6 +68,10 @@ class AcerWorker(Worker):
             self.inc_global_step, # TODO is it the correct way to use?
         ]
 
+        # Same as step_op but without evaluating summaries
+        self.step_op_no_summaries = list(self.step_op)
+        self.step_op_no_summaries[1] = []
+
     def _run(self):
 
         # if resume from some unfinished training, we first re-generate
@@ -102,10 +110,12 @@ class AcerWorker(Worker):
 
         # Collect rollout {(s_0, a_0, r_0, mu_0), (s_1, ...), ... }
         # FLAGS.max_steps = int(np.ceil(FLAGS.t_max * FLAGS.command_freq))
-        rollout = self.run_n_steps(FLAGS.max_steps)
+        with self.profiler.span("rollout"):
+            rollout = self.run_n_steps(FLAGS.max_steps)
 
         # Compute gradient and Perform update
-        self.update(self.get_partial_rollout(rollout))
+        with self.profiler.span("update_on_policy"):
+            self.update(self.get_partial_rollout(rollout))
 
         # Store experience and collect statistics
         self.store_experience(rollout)
@@ -160,10 +170,12 @@ class AcerWorker(Worker):
             batched_rollouts = self.batch_rollouts(rollouts)
             """
 
-            rollout = rp[chucked_indices[0]]
-            batched_rollouts = self.get_partial_rollout(rollout)
+            with self.profiler.span("replay_io"):
+                rollout = rp[chucked_indices[0]]
+                batched_rollouts = self.get_partial_rollout(rollout)
 
-            self.update(batched_rollouts, on_policy=False, display=(i == 0))
+            with self.profiler.span("update_off_policy"):
+                self.update(batched_rollouts, on_policy=False, display=(i == 0))
 
     def update(self, rollout, on_policy=True, display=True):
 
@@ -177,19 +189,34 @@ class AcerWorker(Worker):
         avg_net = self.Estimator.average_net
 
         # To feeddict
-        feed_dict = {
-            net.r: rollout.reward,
-            net.a: rollout.action,
-            net.done: rollout.done[-1],
-            net.seq_length: rollout.seq_length,
-            avg_net.seq_length: rollout.seq_length,
-        }
-
-        feed_dict.update({net.state[k]:     v for k, v in rollout.states.iteritems()})
-        feed_dict.update({avg_net.state[k]: v for k, v in rollout.states.iteritems()})
-        feed_dict.update({net.pi_behavior.stats[k]: v for k, v in rollout.pi_stats.iteritems()})
-
-        loss, summaries, _, debug, self.gstep = net.update(self.step_op, feed_dict, self.sess)
+        with self.profiler.span("feed_dict"):
+            feed_dict = {
+                net.r: rollout.reward,
+                net.a: rollout.action,
+                net.done: rollout.done[-1],
+                net.seq_length: rollout.seq_length,
+                avg_net.seq_length: rollout.seq_length,
+            }
+
+            feed_dict.update({net.state[k]:     v for k, v in rollout.states.iteritems()})
+            feed_dict.update({avg_net.state[k]: v for k, v in rollout.states.iteritems()})
+            feed_dict.update({net.pi_behavior.stats[k]: v for k, v in rollout.pi_stats.iteritems()})
+
+        # Only evaluate summaries when we're going to write them
+        summarize = self.should_summarize()
+        step_op = self.step_op if summarize else self.step_op_no_summaries
+
+        trace = self.tracer.should_trace(self.gstep + 1)
+        run_kwargs = self.tracer.run_kwargs() if trace else {}
+
+        with self.profiler.span("sess_run"):
+            loss, summaries, _, debug, self.gstep = net.update(
+                step_op, feed_dict, self.sess, **run_kwargs)
+
+        if trace:
+            self.tracer.dump(run_kwargs['run_metadata'], self.gstep)
+
+        self.counter += 1
         loss = AttrDict(loss)
 
         if display and self.name == "worker_0":
@@ -202,10 +229,10 @@ class AcerWorker(Worker):
                 rollout.seq_length, rollout.batch_size, loss.global_norm
             ))
 
-        # Write summaries
-        if self.summary_writer is not None:
+        # Write summaries. FileWriter queues the event to its own writer
+        # thread and flushes every --summary-flush-secs, so don't flush here
+        if summarize:
             self.summary_writer.add_summary(summaries, self.gstep)
-            self.summary_writer.flush()
 
         # Show learning rate every FLAGS.decay_steps
         if self.gstep % FLAGS.decay_steps == 1:
@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from drl.ac.utils import *
 FLAGS = tf.flags.FLAGS
@@ -11,54 +12,244 @@ def create_distribution(dist_type, bijectors=None, **stats):
     # Need broadcaster to make every as the shape [seq_length, batch_size, ...]
     broadcaster = stats['param1'][..., 0] * 0
 
-    DIST = tf.contrib.distributions.Normal if dist_type == "normal" else tf.contrib.distributions.Beta
+    # param3 is the degrees of freedom of StudentT and the component logits
+    # of GMM, see drl.ac.policies
+    phi = [
+        tf_print(tf_check_numerics(stats[k]))
+        for k in ['param1', 'param2', 'param3'] if k in stats
+    ]
 
-    param1 = tf_check_numerics(stats['param1'])
-    param2 = tf_check_numerics(stats['param2'])
+    # Only used for sampling and KL divergence, densities and entropy are
+    # computed by the closed-form kernels below. GMM samples on its own
+    dist = DISTRIBUTIONS[dist_type](*phi) if dist_type in DISTRIBUTIONS else None
+    pi = to_transformed_distribution(dist, dist_type, phi)
 
-    param1 = tf_print(param1)
-    param2 = tf_print(param2)
-
-    dist = DIST(param1, param2, allow_nan_stats=False)
-    pi = to_transformed_distribution(dist, dist_type)
-
-    pi.phi = [param1, param2]
+    pi.phi = phi
+    pi.dist_type = dist_type
     pi.stats = AttrDict(stats)
 
     return pi
 
-def to_transformed_distribution(dist, dist_type):
+DISTRIBUTIONS = {
+    "normal": lambda mu, sigma: tf.contrib.distributions.Normal(
+        mu, sigma, allow_nan_stats=False),
+    "beta": lambda alpha, beta: tf.contrib.distributions.Beta(
+        alpha, beta, allow_nan_stats=False),
+    "studentt": lambda loc, scale, df: tf.contrib.distributions.StudentT(
+        df, loc, scale, allow_nan_stats=False),
+}
+
+def lazy(fn):
+    # Create ops on first use only (e.g. entropy of behavior policy is never
+    # used), and only once
+    cache = []
+    def get():
+        if len(cache) == 0:
+            cache.append(fn())
+        return cache[0]
+    return get
+
+def normal_kernel(mu, sigma):
+    """
+    Closed-form log-density and entropy of a diagonal Gaussian, sharing the
+    normalizer -log(sigma) - log(2 pi) / 2
+    """
+    log_norm = lazy(lambda: -tf.log(sigma) - 0.5 * np.log(2 * np.pi))
+    inv_sigma = lazy(lambda: tf.reciprocal(sigma))
+
+    def log_prob(x):
+        return log_norm() - 0.5 * tf.square((x - mu) * inv_sigma())
+
+    entropy = lazy(lambda: 0.5 - log_norm())
+
+    return log_prob, entropy
+
+def beta_kernel(alpha, beta):
+    """
+    Closed-form log-density and entropy of Beta distributions, sharing the
+    normalizer log B(alpha, beta) = lgamma(a) + lgamma(b) - lgamma(a + b)
+    """
+    log_B = lazy(lambda: tf.lgamma(alpha) + tf.lgamma(beta) - tf.lgamma(alpha + beta))
+
+    def log_prob(x):
+        return (alpha - 1) * tf.log(x) + (beta - 1) * tf.log1p(-x) - log_B()
+
+    entropy = lazy(lambda: (
+        log_B()
+        - (alpha - 1) * tf.digamma(alpha)
+        - (beta  - 1) * tf.digamma(beta)
+        + (alpha + beta - 2) * tf.digamma(alpha + beta)
+    ))
+
+    return log_prob, entropy
+
+def student_t_kernel(loc, scale, df):
+    """
+    Closed-form log-density and entropy of StudentT distributions, sharing
+    log B(df / 2, 1 / 2) + log(df) / 2 + log(scale)
+    """
+    half_df = lazy(lambda: 0.5 * df)
+    half_df_plus_1 = lazy(lambda: 0.5 * (df + 1))
+    log_norm = lazy(lambda: (
+        tf.lgamma(half_df()) + 0.5 * np.log(np.pi) - tf.lgamma(half_df_plus_1())
+        + 0.5 * tf.log(df) + tf.log(scale)
+    ))
+    inv_scale = lazy(lambda: tf.reciprocal(scale))
+
+    def log_prob(x):
+        z = (x - loc) * inv_scale()
+        return -log_norm() - half_df_plus_1() * tf.log1p(tf.square(z) / df)
+
+    entropy = lazy(lambda: (
+        log_norm()
+        + half_df_plus_1() * (tf.digamma(half_df_plus_1()) - tf.digamma(half_df()))
+    ))
+
+    return log_prob, entropy
+
+def split_components(x, K):
+    # [..., K * num_actions] -> [..., K, num_actions]
+    A = x.get_shape()[-1].value // K
+    y = tf.reshape(x, tf.concat([tf.shape(x)[:-1], [K, A]], 0))
+    y.set_shape(x.get_shape()[:-1].concatenate([K, A]))
+    return y
+
+def merge_components(x):
+    # [..., K, num_actions] -> [..., K * num_actions]
+    K, A = x.get_shape()[-2].value, x.get_shape()[-1].value
+    y = tf.reshape(x, tf.concat([tf.shape(x)[:-2], [K * A]], 0))
+    y.set_shape(x.get_shape()[:-2].concatenate([K * A]))
+    return y
+
+def log_softmax(logits):
+    return logits - tf.reduce_logsumexp(logits, axis=-1, keep_dims=True)
+
+def gmm_kernel(mu, sigma, logits):
+    """
+    log-density of a mixture of K diagonal Gaussians (mu and sigma are
+    [..., K * num_actions], logits [..., K]). Densities of all components are
+    evaluated by one broadcasted normal_kernel and combined by log-sum-exp.
+    Entropy has no closed form, H(w) + sum_k w_k H_k is used instead, which is
+    an upper bound and exact when components don't overlap
+    """
+    K = logits.get_shape()[-1].value
+
+    component_log_prob, component_entropy = normal_kernel(
+        split_components(mu, K), split_components(sigma, K))
+
+    log_w = lazy(lambda: log_softmax(logits))
+
+    def log_prob(x):
+        # [..., num_actions] -> [..., 1, num_actions] to broadcast over K
+        lp = tf.reduce_sum(component_log_prob(x[..., None, :]), axis=-1)
+        return tf.reduce_logsumexp(log_w() + lp, axis=-1)
+
+    def entropy():
+        H_k = tf.reduce_sum(component_entropy(), axis=-1)
+        return tf.reduce_sum(tf.exp(log_w()) * (H_k - log_w()), axis=-1)
+
+    return log_prob, lazy(entropy)
+
+def gmm_sampler(mu, sigma, logits):
+
+    K = logits.get_shape()[-1].value
+    mu, sigma = split_components(mu, K), split_components(sigma, K)
+
+    def sample(n):
+        # Draw component indices of all [S, B] with one multinomial op, then
+        # reparameterize within the chosen component
+        batch_shape = tf.shape(logits)[:-1]
+        k = tf.multinomial(tf.reshape(logits, [-1, K]), n)
+        k = tf.reshape(tf.transpose(k), tf.concat([[n], batch_shape], 0))
+        one_hot = tf.one_hot(k, K, dtype=mu.dtype)[..., None]
+
+        mu_k = tf.reduce_sum(one_hot * mu, axis=-2)
+        sigma_k = tf.reduce_sum(one_hot * sigma, axis=-2)
+
+        return mu_k + sigma_k * tf.random_normal(tf.shape(mu_k), dtype=mu.dtype)
+
+    return sample
+
+def create_kernel(dist_type, phi):
+    """
+    Returns log_prob(x) and entropy() of the whole action vector, i.e.
+    already summed over action dimensions
+    """
+    if dist_type == "gmm":
+        return gmm_kernel(*phi)
+
+    kernel = {
+        "normal": normal_kernel,
+        "beta": beta_kernel,
+        "studentt": student_t_kernel,
+    }[dist_type]
+
+    log_prob, entropy = kernel(*phi)
+
+    return (
+        lambda x: tf.reduce_sum(log_prob(x), axis=-1),
+        lazy(lambda: tf.reduce_sum(entropy(), axis=-1))
+    )
+
+def to_transformed_distribution(dist, dist_type, phi):
 
     low  = tf_const(FLAGS.action_space.low )[None, None, None, ...]
     high = tf_const(FLAGS.action_space.high)[None, None, None, ...]
 
+    kernel_log_prob, kernel_entropy = create_kernel(dist_type, phi)
+    sample = gmm_sampler(*phi) if dist_type == "gmm" else dist.sample
+
+    # log-densities already computed, keyed by the action tensor
+    log_prob_cache = {}
+    prob_cache = {}
+
+    def log_probs(xs, msg=None):
+        """
+        log-densities of several action tensors (each [S, B, num_actions]) in
+        one batched op. Results are cached, so asking again for the same
+        action tensor doesn't add any op.
+        """
+        missing = [x for x in xs if x not in log_prob_cache]
+
+        if len(missing) > 0:
+            x = tf.stack(missing)
+            if dist_type == "beta":
+                x = clip((x - low) / (high - low), 0., 1.)
+
+            lp = kernel_log_prob(x)
+
+            for x_i, lp_i in zip(missing, tf.unstack(lp, num=len(missing))):
+                log_prob_cache[x_i] = lp_i
+
+        return [log_prob_cache[x] for x in xs]
+
     def log_prob(x, msg=None):
-        x = x[None, ...]
-        if dist_type == "beta":
-            x = clip((x - low) / (high - low), 0., 1.)
-        return tf.reduce_sum(dist.log_prob(x)[0, ...], axis=-1)
+        return log_probs([x], msg)[0]
 
     def prob(x, msg=None):
-        return tf.exp(log_prob(x))
+        if x not in prob_cache:
+            prob_cache[x] = tf.exp(log_prob(x))
+        return prob_cache[x]
 
     def entropy():
-        return tf.reduce_sum(dist.entropy(), axis=-1)
+        return kernel_entropy()
 
     def sample_n(n, msg=None):
 
         # sample_n is deprecated starting from TensorFlow v1.0
-        samples = dist.sample(n)
+        samples = sample(n)
 
-        if dist_type == "normal":
-            samples = clip(samples, low, high)
-        else:
+        if dist_type == "beta":
             samples = samples * (high - low) + low
+        else:
+            samples = clip(samples, low, high)
 
         return samples
 
     return AttrDict(
         prob = prob,
         log_prob = log_prob,
+        log_probs = log_probs,
         sample_n = sample_n,
         entropy = entropy,
         dist = dist
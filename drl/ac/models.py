@@ -3,19 +3,30 @@ import tensorflow as tf
 from drl.ac.utils import *
 FLAGS = tf.flags.FLAGS
 
-def naive_mean_steer_policy(front_view):
-    H, W = front_view.get_shape().as_list()[2:4]
+def preprocess_front_view(front_view):
+    """
+    Front view stage shared by the convnet and naive_mean_steer_policy:
+    average pool [S, B, H, W, C] by --graph-downsample with the same stride,
+    in one op over all S * B. See downsample_front_view for the NumPy twin.
+    --downsample is applied by OffRoadNav itself, not here
+    """
+    k = FLAGS.graph_downsample
+    if k == 1:
+        return front_view
+
+    S, B = get_seq_length_batch_size(front_view)
 
-    yv, xv = np.meshgrid(range(H), range(W))
-    xv = xv.astype(np.float32)
-    yv = yv.astype(np.float32)
+    x = tf.nn.avg_pool(flatten(front_view), [1, k, k, 1], [1, k, k, 1], "VALID")
 
-    theta = np.arctan((yv - W / 2 + 0.5) / (H - xv - 0.5))
+    return deflatten(x, S, B)
 
-    # Make sure it's symmetric with negative sign
-    assert np.all(theta[:, :W/2] == -theta[:, -1:W/2-1:-1])
+def naive_mean_steer_policy(front_view):
+    H, W = front_view.get_shape().as_list()[2:4]
+
+    # Angle table is computed once per observed front view shape and --graph-downsample
+    theta = tf_const(steering_angle_table(H, W, FLAGS.graph_downsample))[None, None, ..., None]
 
-    theta = tf_const(theta)[None, None, ..., None]
+    front_view = preprocess_front_view(front_view)
 
     # Substract min from front_view to make sure positivity
     r = front_view - tf.reduce_min(front_view, keep_dims=True,
@@ -43,6 +54,14 @@ def get_state_placeholder():
 
     if "OffRoadNav" in FLAGS.game:
         front_view_shape = list(FLAGS.observation_space.spaces[0].shape)
+
+        # OffRoadNav already shrinks the front view by --downsample, angle
+        # tables are keyed on this observed shape
+        FOV = FLAGS.field_of_view // FLAGS.downsample
+        assert front_view_shape[:2] == [FOV, FOV], \
+            "Front view of env is {}, expected {} x {} (--field-of-view // --downsample)".format(
+                front_view_shape[:2], FOV, FOV)
+
         front_view    = tf.placeholder(FLAGS.dtype, [S, B] + front_view_shape, "front_view")
         vehicle_state = tf.placeholder(FLAGS.dtype, [S, B, 6], "vehicle_state")
 
@@ -124,8 +143,7 @@ def LSTM(input, num_outputs, scope=None, state_in_fw=None, state_in_bw=None):
 
 def build_convnet(front_view, params):
 
-    S, B = get_seq_length_batch_size(front_view)
-    layers = [flatten(front_view)]
+    layers = [flatten(preprocess_front_view(front_view))]
 
     with tf.name_scope("conv"):
 
@@ -1,22 +1,57 @@
 import numpy as np
 import tensorflow as tf
+from drl.ac.utils import *
 from drl.ac.distributions import create_distribution
 from drl.ac.models import policy_network
 FLAGS = tf.flags.FLAGS
 
 def build_policy(input, dist_type):
+    if FLAGS.mixture_model and dist_type != "Gaussian":
+        raise ValueError('--mixture-model is only supported by "Gaussian"')
+
     if dist_type == "Gaussian":
+        if FLAGS.mixture_model:
+            return gmm_policy(input, FLAGS.num_mixtures)
         return gaussian_policy(input)
     elif dist_type == "Beta":
         return beta_policy(input)
+    elif dist_type == "StudentT":
+        return student_t_policy(input)
     else:
-        raise ValueError('dist_type must be either "Gaussian" or "Beta"')
+        raise ValueError('dist_type must be either "Gaussian", "Beta" or "StudentT"')
 
-def get_param_placeholder(name):
+def get_param_placeholder(name, size=None):
     return tf.placeholder(FLAGS.dtype, [
-        FLAGS.seq_length, FLAGS.batch_size, FLAGS.num_actions
+        FLAGS.seq_length, FLAGS.batch_size, size or FLAGS.num_actions
     ], name=name)
 
+def dense(input, num_outputs, scope):
+
+    rank = get_rank(input)
+
+    if rank == 3:
+        S, B = get_seq_length_batch_size(input)
+        input = flatten(input)
+
+    output = tf.contrib.layers.fully_connected(
+        inputs=input,
+        num_outputs=num_outputs,
+        activation_fn=None,
+        scope=scope)
+
+    if rank == 3:
+        output = deflatten(output, S, B)
+
+    return output
+
+def action_bounds(like, K=1):
+    # low and high of action space broadcasted to like, [S, B, K * num_actions]
+    AS = FLAGS.action_space
+    broadcaster = like[..., 0:1] * 0
+    low  = tf_const(np.tile(AS.low , K))[None, None, :] + broadcaster
+    high = tf_const(np.tile(AS.high, K))[None, None, :] + broadcaster
+    return low, high
+
 def beta_policy(input):
 
     alpha, beta = policy_network(input, FLAGS.num_actions, clip_mu=False)
@@ -38,10 +73,7 @@ def gaussian_policy(input):
 
     mu, sigma = policy_network(input, FLAGS.num_actions, clip_mu=False)
 
-    AS = FLAGS.action_space
-    broadcaster = mu[..., 0:1] * 0
-    low  = tf_const(AS.low )[None, None, :] + broadcaster
-    high = tf_const(AS.high)[None, None, :] + broadcaster
+    low, high = action_bounds(mu)
     mu    = softclip(mu, low , high)
 
     # sigma = tf.nn.softplus(sigma) + 1e-4
@@ -56,3 +88,51 @@ def gaussian_policy(input):
     )
 
     return pi, pi_behavior
+
+def student_t_policy(input):
+
+    loc, scale = policy_network(input, FLAGS.num_actions, clip_mu=False)
+
+    low, high = action_bounds(loc)
+    loc   = softclip(loc, low, high)
+    scale = softclip(scale, 1e-4, (high - low) / 2.)
+
+    # df > 2 s.t. variance is finite
+    df = tf.nn.softplus(dense(input, FLAGS.num_actions, "policy-df")) + 2
+
+    pi = create_distribution(dist_type="studentt", param1=loc, param2=scale, param3=df)
+
+    pi_behavior = create_distribution(
+        dist_type="studentt",
+        param1 = get_param_placeholder("param1"),
+        param2 = get_param_placeholder("param2"),
+        param3 = get_param_placeholder("param3"),
+    )
+
+    return pi, pi_behavior
+
+def gmm_policy(input, K):
+    """
+    Mixture of K diagonal Gaussians. Means and stds of all components are
+    packed along the last axis as [S, B, K * num_actions], and component
+    logits are [S, B, K], so that behavior policy stats are batched and
+    stored just like those of single Gaussian
+    """
+    mu, sigma = policy_network(input, K * FLAGS.num_actions, clip_mu=False)
+
+    low, high = action_bounds(mu, K)
+    mu    = softclip(mu, low , high)
+    sigma = softclip(sigma, 1e-4, (high - low) / 2.)
+
+    logits = dense(input, K, "policy-logits")
+
+    pi = create_distribution(dist_type="gmm", param1=mu, param2=sigma, param3=logits)
+
+    pi_behavior = create_distribution(
+        dist_type="gmm",
+        param1 = get_param_placeholder("param1", K * FLAGS.num_actions),
+        param2 = get_param_placeholder("param2", K * FLAGS.num_actions),
+        param3 = get_param_placeholder("param3", K),
+    )
+
+    return pi, pi_behavior
@@ -0,0 +1,175 @@
+import tensorflow as tf
+from drl.ac.utils import tf_const
+from drl.ac.distributions import split_components, merge_components, log_softmax
+FLAGS = tf.flags.FLAGS
+
+def gaussian_kl_and_grads(avg_phi, phi):
+    """
+    KL(N(mu0, sigma0) || N(mu, sigma)) for each action dimension, and its
+    partial derivatives w.r.t. (mu, sigma)
+    """
+    mu0, sigma0 = avg_phi
+    mu, sigma = phi
+
+    inv_var = 1. / tf.square(sigma)
+    diff = mu - mu0
+    m2 = tf.square(sigma0) + tf.square(diff)
+
+    KL = tf.log(sigma / sigma0) + 0.5 * m2 * inv_var - 0.5
+
+    d_mu = diff * inv_var
+    d_sigma = (1. - m2 * inv_var) / sigma
+
+    return KL, [d_mu, d_sigma]
+
+def beta_kl_and_grads(avg_phi, phi):
+    """
+    KL(Beta(a0, b0) || Beta(a, b)) for each action dimension, and its partial
+    derivatives w.r.t. (a, b). Uses d log B(a, b) / da = psi(a) - psi(a + b)
+    """
+    a0, b0 = avg_phi
+    a, b = phi
+
+    def log_B(a, b):
+        return tf.lgamma(a) + tf.lgamma(b) - tf.lgamma(a + b)
+
+    psi_a0, psi_b0, psi_ab0 = tf.digamma(a0), tf.digamma(b0), tf.digamma(a0 + b0)
+    psi_ab = tf.digamma(a + b)
+
+    KL = (
+        log_B(a, b) - log_B(a0, b0)
+        + (a0 - a) * psi_a0
+        + (b0 - b) * psi_b0
+        + (a - a0 + b - b0) * psi_ab0
+    )
+
+    d_a = tf.digamma(a) - psi_ab - psi_a0 + psi_ab0
+    d_b = tf.digamma(b) - psi_ab - psi_b0 + psi_ab0
+
+    return KL, [d_a, d_b]
+
+def gmm_kl_and_grads(avg_phi, phi):
+    """
+    KL between two GMMs has no closed form. Since average net and this net
+    share component ordering, use the upper bound with matched components
+    KL(w0 || w) + sum_k w0_k KL(N0_k || N_k), and its partial derivatives
+    w.r.t. (mu, sigma, logits). Returns KL as [..., 1]
+    """
+    mu0, sigma0, logits0 = avg_phi
+    mu, sigma, logits = phi
+
+    K = logits.get_shape()[-1].value
+
+    KL_k, [d_mu, d_sigma] = gaussian_kl_and_grads(
+        [split_components(mu0, K), split_components(sigma0, K)],
+        [split_components(mu, K), split_components(sigma, K)]
+    )
+
+    log_w0, log_w = log_softmax(logits0), log_softmax(logits)
+    w0 = tf.exp(log_w0)
+
+    KL = tf.reduce_sum(
+        w0 * (log_w0 - log_w + tf.reduce_sum(KL_k, axis=-1)),
+        axis=-1, keep_dims=True)
+
+    d_mu = merge_components(w0[..., None] * d_mu)
+    d_sigma = merge_components(w0[..., None] * d_sigma)
+    d_logits = tf.exp(log_w) - w0
+
+    return KL, [d_mu, d_sigma, d_logits]
+
+# Distributions whose KL and d(KL)/d(phi) are known in closed form (or, for
+# GMM, a closed-form upper bound)
+ANALYTIC_KL = {
+    "normal": gaussian_kl_and_grads,
+    "beta": beta_kl_and_grads,
+    "gmm": gmm_kl_and_grads,
+}
+
+def kl_and_grads(pi_avg, pi):
+    """
+    Returns KL(pi_avg || pi) summed over action dimensions, and its
+    derivatives w.r.t. pi.phi concatenated along the last axis. Closed-form
+    when available, otherwise through tf.gradients. Raises
+    NotImplementedError if KL itself isn't available
+    """
+    kl_fn = ANALYTIC_KL.get(pi.get("dist_type"))
+
+    if kl_fn is not None:
+        KL, grads = kl_fn(pi_avg.phi, pi.phi)
+        return tf.reduce_sum(KL, axis=2), tf.concat(grads, -1)
+
+    KL_divergence = tf.reduce_sum(tf.contrib.distributions.kl(
+        pi_avg.dist, pi.dist, allow_nan=False), axis=2)
+
+    return KL_divergence, tf.concat(tf.gradients(KL_divergence, pi.phi), -1)
+
+def add_fast_TRPO_regularization(pi, avg_net_pi, obj):
+
+    # ACER gradient is the gradient of policy objective function, which is
+    # the negatation of policy loss. Note that obj also depends on phi through
+    # the sampled a', so this one stays autodiff
+    g = tf.concat(tf.gradients(obj, pi.phi), -1,)
+
+    g_trpo, mean_KL = compute_trust_region_update(g, avg_net_pi, pi)
+
+    # surrogate objective function
+    phi = tf.concat(pi.phi, -1)
+    obj_sur = phi * g_trpo
+
+    return obj_sur, mean_KL
+
+def compute_trust_region_update(g, pi_avg, pi, delta=0.5):
+    """
+    In ACER's original paper, they use delta uniformly sampled from [0.1, 2]
+    """
+    try:
+        # Compute the KL-divergence between the policy distribution of the
+        # average policy network and those of this network, i.e. KL(avg || this)
+        # and take the partial derivatives w.r.t. phi (i.e. mu and sigma)
+        KL_divergence, k = kl_and_grads(pi_avg, pi)
+
+        mean_KL = tf.reduce_mean(KL_divergence)
+
+        # k^T k can be tiny, project in accumulate_dtype
+        dtype = FLAGS.accumulate_dtype
+        k, g_acc = tf.cast(k, dtype), tf.cast(g, dtype)
+
+        # Compute \frac{k^T g - \delta}{k^T k}, perform reduction only on axis 2
+        num   = tf.reduce_sum(k * g_acc, axis=2, keep_dims=True) - delta
+        denom = tf.reduce_sum(k * k, axis=2, keep_dims=True)
+
+        # Hold gradient back a little bit if KL divergence is too large
+        correction = tf.maximum(tf.constant(0., dtype), num / denom) * k
+
+        # z* is the TRPO regularized gradient
+        z_star = tf.cast(g_acc - correction, g.dtype)
+
+    except NotImplementedError:
+        tf.logging.warn("\33[33mFailed to create TRPO update. Fall back to normal update\33[0m")
+        z_star = g
+        mean_KL = tf_const(0.)
+
+    # By using stop_gradient, we make z_star being treated as a constant
+    z_star = tf.stop_gradient(z_star)
+
+    return z_star, mean_KL
+
+def check_kl_grads(pi_avg, pi):
+    """
+    Gradient check: max absolute difference between the closed-form
+    d(KL)/d(phi) and the one from tf.gradients of the closed-form KL, and
+    between closed-form KL and tf.contrib's (only if pi.dist has one, GMM
+    doesn't). Both should be ~0
+    """
+    KL, k = kl_and_grads(pi_avg, pi)
+    k_autodiff = tf.concat(tf.gradients(KL, pi.phi), -1)
+
+    errors = {"grad": tf.reduce_max(tf.abs(k - k_autodiff))}
+
+    if pi.dist is not None:
+        KL_contrib = tf.reduce_sum(tf.contrib.distributions.kl(
+            pi_avg.dist, pi.dist, allow_nan=False), axis=2)
+        errors["KL"] = tf.reduce_max(tf.abs(KL - KL_contrib))
+
+    return errors
@@ -2,20 +2,18 @@
 import os
 import time
 import zlib
-import psutil
+import hashlib
 import numpy as np
-import scipy.signal
-import scipy.interpolate as interpolate
 import tensorflow as tf
 import inspect
-import schedule
-import cv2
 import gym
 import sys
 import cPickle
+import threading
 from numbers import Number
-from collections import Set, Mapping, deque
+from collections import Set, Mapping, OrderedDict, deque
 from gym import spaces
+from drl.profiler import Profiler
 FLAGS = tf.flags.FLAGS
 
 def get_dof(space):
@@ -90,100 +88,261 @@ def form_state(env, env_state, prev_action, prev_reward, hidden_states):
 
     return state
 
+# States that are observations of env, see get_state_placeholder. Only these
+# are stored as --storage-precision, other states (LSTM hidden states,
+# prev_action and prev_reward) wouldn't survive e.g. uint8
+OBSERVATION_KEYS = ["front_view", "vehicle_state", "state"]
+
+def to_storage_dtype(rollout):
+    """
+    Returns a shallow copy of rollout whose floating point observations are
+    cast to FLAGS.storage_dtype. Other floating point states, and observations
+    if it's not set, are only downcast to the compute dtype (e.g. float64 from
+    env with float32 nets) and never upcast, so --double-precision doesn't
+    double replay memory. Actions and behavior policy stats are kept as is
+    since importance weights are sensitive to them. TF casts them back when
+    fed to placeholders
+    """
+    compute_dtype = np.dtype(FLAGS.dtype.as_numpy_dtype)
+
+    def cast(k, v):
+        if v.dtype.kind != 'f':
+            return v
+        dtype = FLAGS.storage_dtype if k in OBSERVATION_KEYS else None
+        if dtype is None:
+            return v.astype(compute_dtype) if v.dtype.itemsize > compute_dtype.itemsize else v
+        return v.astype(dtype) if v.dtype != dtype else v
+
+    states = AttrDict({k: cast(k, v) for k, v in rollout.states.iteritems()})
+
+    return AttrDict(rollout, states=states)
+
+class GrowableArray(object):
+    """
+    Append-only 1-D NumPy array with amortized O(1) append (capacity doubles)
+    """
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def _reserve(self, n):
+        if self.size + n > len(self.data):
+            capacity = max(2 * len(self.data), self.size + n)
+            data = np.empty(capacity, dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, x):
+        self._reserve(1)
+        self.data[self.size] = x
+        self.size += 1
+
+    def extend(self, xs):
+        xs = np.asarray(xs).ravel()
+        self._reserve(len(xs))
+        self.data[self.size:self.size + len(xs)] = xs
+        self.size += len(xs)
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+class WindowStats(object):
+    """
+    Mean and (population) standard deviation of the last `maxlen` values in
+    O(1) per push, using Welford's algorithm on a sliding window. To bound
+    floating point drift, the moments are recomputed exactly from the ring
+    buffer every time it wraps around (amortized O(1)).
+    """
+    def __init__(self, maxlen):
+        self.ring = np.zeros(maxlen, dtype=np.float64)
+        self.maxlen = maxlen
+        self.n = 0
+        self.idx = 0
+        self.mean = 0.
+        self.M2 = 0.
+
+    def push(self, x):
+        x = float(x)
+
+        if self.n < self.maxlen:
+            self.n += 1
+            delta = x - self.mean
+            self.mean += delta / self.n
+            self.M2 += delta * (x - self.mean)
+        else:
+            old = self.ring[self.idx]
+            mean = self.mean + (x - old) / self.n
+            self.M2 += (x - old) * (x - mean + old - self.mean)
+            self.mean = mean
+
+        self.ring[self.idx] = x
+        self.idx = (self.idx + 1) % self.maxlen
+
+        if self.idx == 0:
+            self.mean = np.mean(self.ring)
+            self.M2 = np.sum((self.ring - self.mean) ** 2)
+
+    def std(self):
+        if self.n == 0:
+            return 0.
+        return np.sqrt(max(self.M2, 0.) / self.n)
+
 class EpisodeStats(object):
-    def __init__(self):
-        self.episode_lengths = []
-        self.episode_rewards = []
+    """
+    Thread-safe statistics of all episodes played by all workers. Per-episode
+    values are kept in growable NumPy arrays (rewards of all agents are
+    flattened into one array with per-episode offsets), the total number of
+    timesteps is a running sum, and the mean/std of the last FLAGS.min_episodes
+    returns is maintained incrementally.
+    """
+    def __init__(self, window=None):
+        self.lock = threading.Lock()
+
+        self.lengths = GrowableArray(np.int64)
+        self.rewards = GrowableArray(np.float64)
+        self.times = GrowableArray(np.float64)
 
         # This is different from OpenAI gym spec because we run multiple agents
-        self.episode_rewards_all_agents = []
-        self.episode_types = []
+        self.num_agents = GrowableArray(np.int32)
+        self.rewards_all_agents = GrowableArray(np.float64)
+
+        self.total_timesteps = 0
+        self.window = WindowStats(window or FLAGS.min_episodes)
         self.initial_reset_timestamp = None
-        self.timestamps = []
 
     def set_initial_timestamp(self):
-        if self.initial_reset_timestamp is None:
-            self.initial_reset_timestamp = time.time()
+        with self.lock:
+            if self.initial_reset_timestamp is None:
+                self.initial_reset_timestamp = time.time()
 
     def append(self, length, reward, rewards_all_agent):
-        self.episode_lengths.append(length)
-        self.episode_rewards_all_agents.append(rewards_all_agent)
-        self.episode_rewards.append(reward)
-        self.timestamps.append(time.time())
-
-        timesteps = np.sum(self.episode_lengths)
-
-        if self.num_episodes() % FLAGS.log_episode_stats_every_nth == 0:
-            # set print options
-            np.set_printoptions(
-                formatter={'float_kind': lambda x: "{:.2f}".format(x)},
-                linewidth=1000
-            )
+        rewards_all_agent = np.asarray(rewards_all_agent).ravel()
+
+        with self.lock:
+            self.lengths.append(length)
+            self.rewards.append(reward)
+            self.times.append(time.time())
+            self.num_agents.append(len(rewards_all_agent))
+            self.rewards_all_agents.extend(rewards_all_agent)
+
+            self.total_timesteps += length
+            self.window.push(reward)
 
+            num_episodes = len(self.lengths)
+            timesteps = self.total_timesteps
+
+        if num_episodes % FLAGS.log_episode_stats_every_nth == 0:
             fmt = "Episode {:05d} [{}]: return: {} [mean = {:.2f}], length = {}"
             tf.logging.info(fmt.format(
-                self.num_episodes(),timesteps,rewards_all_agent,reward,length
+                num_episodes, timesteps, np.array2string(
+                    rewards_all_agent, max_line_width=1000,
+                    formatter={'float_kind': lambda x: "{:.2f}".format(x)}),
+                reward, length
             ))
 
-            # reset print options
-            np.set_printoptions()
+    @property
+    def episode_lengths(self):
+        return self.lengths.values
 
-    def __str__(self):
+    @property
+    def episode_rewards(self):
+        return self.rewards.values
 
-        stats = zip(
-            self.episode_lengths, self.episode_rewards,
-            self.timestamps, self.episode_rewards_all_agents
-        )
+    @property
+    def timestamps(self):
+        return self.times.values
 
-        # set print options
-        np.set_printoptions(
-            linewidth=1000,
-            formatter={'float_kind': lambda x: "{:.5f}".format(x)}
-        )
+    def to_arrays(self, start=0):
+        """
+        Returns a consistent snapshot of statistics of episodes [start:] as
+        NumPy arrays
+        """
+        with self.lock:
+            num_agents = self.num_agents.values[start:].copy()
+            flat_start = np.sum(self.num_agents.values[:start])
+            return AttrDict(
+                episode_lengths = self.lengths.values[start:].copy(),
+                episode_rewards = self.rewards.values[start:].copy(),
+                timestamps = self.times.values[start:].copy(),
+                num_agents = num_agents,
+                rewards_all_agents = self.rewards_all_agents.values[flat_start:].copy(),
+                offsets = np.concatenate([[0], np.cumsum(num_agents)]),
+            )
+
+    def __str__(self):
+
+        stats = self.to_arrays()
 
         HEADER = "{}\t{}\t{}\t{}\t{}\t{}\n"
-        s = HEADER.format("Episode", "Length", "Reward", "Timestamp", "NumAgents", "Rewards")
+        rows = [HEADER.format("Episode", "Length", "Reward", "Timestamp", "NumAgents", "Rewards")]
 
         ROW = "{}\t{}\t{:.5f}\t{}\t{}\t{}\n"
-        for i, (l, r, t, rs) in enumerate(stats):
-            s += ROW.format(i, l, r, t, len(rs), rs)
-
-        # reset print options
-        np.set_printoptions()
+        fmt = {'float_kind': lambda x: "{:.5f}".format(x)}
+        for i in range(len(stats.episode_lengths)):
+            rs = stats.rewards_all_agents[stats.offsets[i]:stats.offsets[i+1]]
+            rows.append(ROW.format(
+                i, stats.episode_lengths[i], stats.episode_rewards[i],
+                stats.timestamps[i], len(rs),
+                np.array2string(rs, max_line_width=1000, formatter=fmt)
+            ))
 
-        return s
+        return "".join(rows)
 
     def last_n_stats(self, N=None):
         if N is None:
             N = FLAGS.min_episodes
 
-        if self.num_episodes() == 0:
-            mean, std = 0, 0
-        else:
-            last_n = self.episode_rewards[-N:]
-            mean, std = np.mean(last_n), np.std(last_n)
+        with self.lock:
+            num_episodes = len(self.lengths)
+
+            if num_episodes == 0:
+                mean, std = 0, 0
+            elif N == self.window.maxlen:
+                mean, std = self.window.mean, self.window.std()
+            else:
+                last_n = self.rewards.values[-N:]
+                mean, std = np.mean(last_n), np.std(last_n)
 
-        if self.num_episodes() % FLAGS.log_episode_stats_every_nth == 0:
+        if num_episodes % FLAGS.log_episode_stats_every_nth == 0:
             fmt = "\33[33mLast {} episodes' score: {:.4f} ± {:.4f}\33[0m"
             tf.logging.info(fmt.format(N, mean, std))
 
         return mean, std
 
     def num_episodes(self):
-        return len(self.episode_lengths)
+        return len(self.lengths)
 
     def summary(self):
-        _, _, s = self.last_n_stats()
-        s += "\nTotal returns: {}".format(self.episode_rewards)
-        s += "\nEpisode lengths: {}".format(self.episode_lengths)
+        mean, std = self.last_n_stats()
+        stats = self.to_arrays()
+        s = "Last {} episodes' score: {:.4f} ± {:.4f}".format(self.window.maxlen, mean, std)
+        s += "\nTotal episodes: {}, total timesteps: {}".format(
+            len(stats.episode_lengths), self.total_timesteps)
+        s += "\nTotal returns: {}".format(stats.episode_rewards)
+        s += "\nEpisode lengths: {}".format(stats.episode_lengths)
         s += "\ninitial_reset_timestamp: {}".format(self.initial_reset_timestamp)
-        s += "\ntimestamps: {}".format(self.timestamps)
+        s += "\ntimestamps: {}".format(stats.timestamps)
         return s
 
-def state_featurizer(env):
+FEATURIZER_VERSION = 2
 
-    if FLAGS.game != "MountainCarContinuous-v0":
-        return lambda x: x, FLAGS.num_states
+def featurizer_cache_path(env):
+    # Fitted featurizer only depends on the game, the bounds of observation
+    # space it samples from and the random seed, so hash them into file name.
+    # Bump FEATURIZER_VERSION whenever fit_featurizer changes
+    space = env.observation_space
+    key = "{}|{}|{}|{}|{}".format(
+        FLAGS.game, np.asarray(space.low).tolist(),
+        np.asarray(space.high).tolist(), FLAGS.random_seed, FEATURIZER_VERSION
+    )
+    digest = hashlib.md5(key).hexdigest()[:16]
+    return "{}/featurizer-{}-{}.pkl".format(FLAGS.cache_dir, FLAGS.game, digest)
+
+def fit_featurizer(env):
 
     import sklearn.pipeline
     import sklearn.preprocessing
@@ -199,14 +358,54 @@ def state_featurizer(env):
 
     # Used to converte a state to a featurizes represenation.
     # We use RBF kernels with different variances to cover different parts of the space
+    # Samplers share one RandomState, so that each draws its own weights
+    rng = np.random.RandomState(FLAGS.random_seed)
     featurizer = sklearn.pipeline.FeatureUnion([
-        ("rbf1", RBFSampler(gamma=5.0, n_components=100)),
-        ("rbf2", RBFSampler(gamma=2.0, n_components=100)),
-        ("rbf3", RBFSampler(gamma=1.0, n_components=100)),
-        ("rbf4", RBFSampler(gamma=0.5, n_components=100))
+        ("rbf1", RBFSampler(gamma=5.0, n_components=100, random_state=rng)),
+        ("rbf2", RBFSampler(gamma=2.0, n_components=100, random_state=rng)),
+        ("rbf3", RBFSampler(gamma=1.0, n_components=100, random_state=rng)),
+        ("rbf4", RBFSampler(gamma=0.5, n_components=100, random_state=rng))
     ])
     featurizer.fit(scaler.transform(observation_examples))
 
+    return scaler, featurizer
+
+def load_or_fit_featurizer(env):
+
+    if not FLAGS.cache_featurizer:
+        return fit_featurizer(env)
+
+    path = featurizer_cache_path(env)
+
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                scaler, featurizer = cPickle.load(f)
+            tf.logging.info("Loaded fitted featurizer from {}".format(path))
+            return scaler, featurizer
+        except Exception as e:
+            tf.logging.warn("\33[33mFailed to load {} ({}), re-fit featurizer\33[0m".format(path, e))
+
+    scaler, featurizer = fit_featurizer(env)
+
+    # Write to a temporary file and rename, so that concurrent runs in a sweep
+    # never read a half-written cache
+    mkdir_p(FLAGS.cache_dir)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        cPickle.dump((scaler, featurizer), f, protocol=cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+    tf.logging.info("Saved fitted featurizer to {}".format(path))
+
+    return scaler, featurizer
+
+def state_featurizer(env):
+
+    if FLAGS.game != "MountainCarContinuous-v0":
+        return lambda x: x, FLAGS.num_states
+
+    scaler, featurizer = load_or_fit_featurizer(env)
+
     def featurize_state(state):
         """ Returns the featurized representation for a state.
         """
@@ -223,6 +422,7 @@ def mkdir_p(dirname):
 def show_mem_usage(x=None, subject=None):
 
     if x is None:
+        import psutil
         process = psutil.Process(os.getpid())
         num_bytes = float(process.memory_info().rss)
         subject = "this process"
@@ -239,15 +439,188 @@ def show_mem_usage(x=None, subject=None):
         subject, usage, num_bytes
     ))
 
-def save_model():
-    step = FLAGS.sess.run(tf.contrib.framework.get_global_step())
-    fn = FLAGS.saver.save(FLAGS.sess, FLAGS.save_path, global_step=step)
-    print time.strftime('[%H:%M:%S %Y/%m/%d] model saved to '), fn
+def create_global_variables():
+    """
+    Create graph-wide variables that estimators and workers get from FLAGS:
+    global step, global time, and learning rate
+    """
+    # Keeps track of the number of updates we've performed
+    FLAGS.global_step = tf.Variable(0, name="global_step", trainable=False)
+
+    t = int(time.time())
+    global_time_init = tf.Variable(t, name="global_time_init", dtype=tf.int32, trainable=False)
+    global_time      = tf.Variable(t, name="global_time"     , dtype=tf.int32, trainable=False)
+    FLAGS.global_timestep_placeholder = tf.placeholder(tf.int32, [])
+    FLAGS.set_time_op = tf.assign(global_time, FLAGS.global_timestep_placeholder)
+
+    FLAGS.global_timestep = global_time - global_time_init
+
+    # Learning rate is a variable (loaded after initialization) instead of
+    # a constant, so that a cached graph can be reused with a different one
+    FLAGS.learning_rate_var = tf.Variable(
+        FLAGS.learning_rate, name="learning_rate", dtype=FLAGS.dtype, trainable=False)
+
+def save_model(block=False):
+    # Only snapshot variables here, checkpoint_manager writes them to disk
+    # from its own thread
+    FLAGS.checkpoint_manager.save(FLAGS.sess, FLAGS.global_step, block=block)
+
+STATS_COLUMNS = [
+    "episode_lengths", "episode_rewards", "timestamps", "num_agents",
+    "rewards_all_agents"
+]
+
+class StatsWriter(object):
+    """
+    Streams episode statistics append-only into a directory of compressed
+    .npz segments, each holding only the episodes finished since the previous
+    write, so the cost of a write doesn't grow with the length of training.
+    Use load_statistics() to read them back.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.n_written = 0
+
+        mkdir_p(dirname)
+
+        # Never overwrite segments from a previous (resumed) run
+        self.n_segments = len([
+            f for f in os.listdir(dirname) if f.startswith("segment-")
+        ])
+
+        # also write experiment configuration in MATLAB parseable JSON
+        with open(os.path.join(dirname, "config.txt"), 'w') as f:
+            f.write("'" + repr(FLAGS.exp_config)[1:-1].replace("'", '"') + "'\n")
+
+    def write(self, stats):
+        snapshot = stats.to_arrays(start=self.n_written)
+
+        n_episodes = len(snapshot.episode_lengths)
+        if n_episodes == 0:
+            return
+
+        fn = os.path.join(self.dirname, "segment-{:06d}.npz".format(self.n_segments))
+
+        # Write to a temporary file and rename, so that readers never see a
+        # partially written segment
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, 'wb') as f:
+            np.savez_compressed(f, **{k: snapshot[k] for k in STATS_COLUMNS})
+        os.rename(tmp_fn, fn)
+
+        self.n_written += n_episodes
+        self.n_segments += 1
+
+def load_statistics(dirname):
+    """
+    Load all segments written by StatsWriter and concatenate them. Returns an
+    AttrDict of NumPy arrays, rewards of the i-th episode for all agents are
+    rewards_all_agents[offsets[i]:offsets[i+1]]
+    """
+    segments = sorted([
+        f for f in os.listdir(dirname)
+        if f.startswith("segment-") and f.endswith(".npz")
+    ])
+
+    columns = {k: [] for k in STATS_COLUMNS}
+    for segment in segments:
+        with np.load(os.path.join(dirname, segment)) as data:
+            for k in STATS_COLUMNS:
+                columns[k].append(data[k])
+
+    stats = AttrDict({
+        k: np.concatenate(v) if len(v) > 0 else np.zeros(0)
+        for k, v in columns.iteritems()
+    })
+    stats.offsets = np.concatenate([[0], np.cumsum(stats.num_agents)]).astype(np.int64)
+
+    return stats
 
 def write_statistics():
-    # also print experiment configuration in MATLAB parseable JSON
-    cfg = "'" + repr(FLAGS.exp_config)[1:-1].replace("'", '"') + "'\n"
-    print >> open(FLAGS.stats_file, 'w'), cfg, FLAGS.stats
+    if FLAGS.stats_file is None:
+        return
+
+    if getattr(FLAGS, "stats_writer", None) is None:
+        FLAGS.stats_writer = StatsWriter(FLAGS.stats_file)
+
+    FLAGS.stats_writer.write(FLAGS.stats)
+
+class EpisodeRecorder(object):
+    """
+    Records seed and actions of every episode, which is all we need to replay
+    and render it offline (see render.py). Written append-only as .npz
+    segments like StatsWriter, with actions of all episodes in a segment
+    concatenated along the time axis.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.lock = threading.Lock()
+        self.pending = []
+
+        mkdir_p(dirname)
+        self.n_segments = len([
+            f for f in os.listdir(dirname) if f.startswith("segment-")
+        ])
+
+    def append(self, worker, seed, action, total_return):
+        record = (worker, seed[0], action, np.mean(total_return), time.time())
+        with self.lock:
+            self.pending.append(record)
+
+    def write(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        if len(pending) == 0:
+            return
+
+        workers, seeds, actions, returns, timestamps = zip(*pending)
+
+        fn = os.path.join(self.dirname, "segment-{:06d}.npz".format(self.n_segments))
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, 'wb') as f:
+            np.savez_compressed(
+                f,
+                workers = np.array(workers),
+                seeds = np.array(seeds, dtype=np.uint64),
+                lengths = np.array([len(a) for a in actions], dtype=np.int32),
+                actions = np.concatenate(actions).astype(np.float32),
+                returns = np.array(returns, dtype=np.float32),
+                timestamps = np.array(timestamps),
+            )
+        os.rename(tmp_fn, fn)
+
+        self.n_segments += 1
+
+def load_episodes(dirname):
+    """
+    Load all segments written by EpisodeRecorder as a list of AttrDict with
+    worker, seed, action, total_return and timestamp
+    """
+    segments = sorted([
+        f for f in os.listdir(dirname)
+        if f.startswith("segment-") and f.endswith(".npz")
+    ])
+
+    episodes = []
+    for segment in segments:
+        with np.load(os.path.join(dirname, segment)) as data:
+            offsets = np.concatenate([[0], np.cumsum(data["lengths"])])
+            actions = data["actions"]
+            for i in range(len(data["lengths"])):
+                episodes.append(AttrDict(
+                    worker = str(data["workers"][i]),
+                    seed = int(data["seeds"][i]),
+                    action = actions[offsets[i]:offsets[i+1]],
+                    total_return = float(data["returns"][i]),
+                    timestamp = float(data["timestamps"][i]),
+                ))
+
+    return episodes
+
+def write_episodes():
+    if FLAGS.episode_recorder is not None:
+        FLAGS.episode_recorder.write()
 
 def to_radian(deg):
     return deg / 180. * np.pi
@@ -359,14 +732,6 @@ def make_copy_params_op(v1_list, v2_list, alpha=0.):
         b = tf_const(1.) - alpha
         return tf.group(*[v2.assign(a * v2 + b * v1) for v1, v2 in zip(v1_list, v2_list)])
 
-def discount(x, gamma):
-    # if x.ndim == 1:
-    return scipy.signal.lfilter([1], [1, -gamma], x[::-1], axis=0)[::-1]
-    '''
-    else:
-        return scipy.signal.lfilter([1], [1, -gamma], x[:, ::-1], axis=1)[:, ::-1]
-    '''
-
 def flatten_all(x):
     return tf.reshape(x, [-1])
 
@@ -383,42 +748,183 @@ def deflatten(x, n, m=-1): # de-flatten the first axes
         shape = tf.concat([[n], [m], x.get_shape().as_list()[1:]], 0)
         return tf.reshape(x, shape)
 
-def inverse_transform_sampling_2d(data, n_samples, version=2):
+def build_cdf_tables(data):
+    """
+    Cumulative tables for 2-D inverse transform sampling from density map
+    data of shape [M, N]: marginal CDF over columns (x) of shape [N+1], and
+    the CDFs over rows (y) of all columns laid out in one increasing array of
+    shape [N * (M+1)], column i offset by 2i, so that one np.searchsorted
+    finds rows of samples in different columns
+    """
+    M, N = data.shape
+    data = data.astype(np.float64)
+
+    # Construct horizontal cumulative sum
+    cdf_x = np.zeros(N+1)
+    cdf_x[1:] = np.cumsum(np.sum(data, axis=0))
+    cdf_x /= cdf_x[-1]
+
+    # Construct vertical cumulative sum. Columns without mass are never
+    # sampled, make them uniform to keep the table increasing
+    cdf_y = np.zeros((N, M+1))
+    cdf_y[:, 1:] = np.cumsum(data.T, axis=1)
+    total = cdf_y[:, -1:]
+    cdf_y = np.where(total > 0, cdf_y / np.where(total > 0, total, 1), np.linspace(0, 1, M+1))
+    cdf_y += 2 * np.arange(N)[:, None]
+
+    return AttrDict(shape=(M, N), cdf_x=cdf_x, cdf_y=cdf_y.ravel())
+
+def sample_cdf_tables(tables, n_samples):
+    M, N = tables.shape
+    cdf_x, cdf_y = tables.cdf_x, tables.cdf_y
+
+    rx = np.random.rand(n_samples)
+    ry = np.random.rand(n_samples)
+
+    # Column of each sample, i.e. cdf_x[col] <= rx < cdf_x[col + 1], then
+    # linear interpolation inside the column
+    col = np.clip(np.searchsorted(cdf_x, rx, side='right') - 1, 0, N - 1)
+    xs = col + (rx - cdf_x[col]) / (cdf_x[col + 1] - cdf_x[col])
+
+    # Same for rows, in the CDF table of that column
+    ry += 2 * col
+    i = np.clip(np.searchsorted(cdf_y, ry, side='right') - 1, col * (M+1), col * (M+1) + M - 1)
+    ys = i - col * (M+1) + (ry - cdf_y[i]) / (cdf_y[i + 1] - cdf_y[i])
 
+    return xs, ys
+
+def build_alias_table(data):
+    """
+    Walker's alias table over the M * N cells of density map data, for O(1)
+    sampling per sample when sampling repeatedly from the same map
+    """
     M, N = data.shape
+    K = M * N
 
-    # Construct horizontal cumulative sum for inverse transform sampling
-    cumsum_x = np.zeros(N+1)
-    cumsum_x[1:] = np.cumsum(np.sum(data, axis=0))
-    cumsum_x /= cumsum_x[-1]
-    inv_x_cdf = interpolate.interp1d(cumsum_x, np.arange(N+1))
-
-    # Construct vertical cumulative sum for inverse transform sampling
-    cumsum_y = np.zeros((M+1, N))
-    cumsum_y[1:, :] = np.cumsum(data, axis=0)
-    cumsum_y /= cumsum_y[-1, :]
-    inv_y_cdf = np.array([interpolate.interp1d(cumsum_y[:, i], np.arange(M+1)) for i in range(N)])
-
-    if version == 2:
-        # Version 2 (about 2 times faster)
-        rx = np.random.rand(n_samples, 1)
-        ry = np.random.rand(n_samples, 1)
-        
-        L = (rx <= cumsum_x.reshape(1, -1))
-        x_indices = [l.index(True)-1 for l in L.tolist()]
-        xs = inv_x_cdf(rx)
-        ys = np.array([inv_y_cdf[x_ind](r) for x_ind,r in zip(x_indices, ry)])
+    p = data.astype(np.float64).ravel()
+    p = p / np.sum(p) * K
 
-    else:
-        # Version 1
-        xs = np.zeros(n_samples)
-        ys = np.zeros(n_samples)
-        rand_ = np.random.rand(n_samples, 2)
-        for i, (rx, ry) in enumerate(rand_):
-            x_ind = (rx > cumsum_x).tolist().index(False) - 1
-            xs[i] = inv_x_cdf(rx)
-            ys[i] = inv_y_cdf[x_ind](ry)
+    prob = np.ones(K)
+    alias = np.arange(K)
+
+    small = np.flatnonzero(p < 1).tolist()
+    large = np.flatnonzero(p >= 1).tolist()
+
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = p[s], l
+        p[l] -= 1 - p[s]
+        (small if p[l] < 1 else large).append(l)
+
+    # Leftovers are 1 up to rounding errors, prob and alias already say so
+
+    return AttrDict(shape=(M, N), prob=prob, alias=alias)
+
+def sample_alias_table(table, n_samples):
+    M, N = table.shape
+
+    cell = np.random.randint(M * N, size=n_samples)
+    cell = np.where(np.random.rand(n_samples) < table.prob[cell], cell, table.alias[cell])
 
+    # Uniform inside the cell, same as linear interpolation of the CDFs
+    ys, xs = np.divmod(cell, N)
+    return xs + np.random.rand(n_samples), ys + np.random.rand(n_samples)
+
+class MapSampler(object):
+    """
+    Samples (x, y) over density map data (e.g. reward map used to spawn
+    agents) from tables built once. Use MapSampler.get() to share samplers
+    of the same map across workers and resets, samplers are cached by
+    (--map-def, method, hash of data) and least recently used ones are
+    evicted when there're more than MapSampler.cache_size. Tables are built
+    outside the cache lock, under a lock per key
+    """
+    TABLES = {
+        "cdf": (build_cdf_tables, sample_cdf_tables),
+        "alias": (build_alias_table, sample_alias_table),
+    }
+
+    cache_size = 8
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    # key -> lock held while the tables of key are being built
+    building = {}
+
+    def __init__(self, data, method="cdf"):
+        if method not in MapSampler.TABLES:
+            raise ValueError('method must be either "cdf" or "alias"')
+
+        build, self._sample = MapSampler.TABLES[method]
+        self.method = method
+        self.shape = data.shape
+        self.tables = build(data)
+
+    def sample(self, n):
+        return self._sample(self.tables, n)
+
+    @staticmethod
+    def key(data, method, map_def=None):
+        data = np.ascontiguousarray(data)
+        return (
+            map_def if map_def is not None else FLAGS.map_def, method,
+            data.shape, data.dtype.str, hashlib.md5(data).hexdigest()
+        )
+
+    @staticmethod
+    def get(data, method="cdf", map_def=None):
+        key = MapSampler.key(data, method, map_def)
+        cache = MapSampler.cache
+
+        with MapSampler.lock:
+            sampler = cache.pop(key, None)
+            if sampler is not None:
+                # Most recently used last
+                cache[key] = sampler
+                return sampler
+            building = MapSampler.building.setdefault(key, threading.Lock())
+
+        # Workers resetting with the same map at the same time wait for one
+        # build, while those with other maps (or cache hits) go on
+        with building:
+            with MapSampler.lock:
+                sampler = cache.get(key)
+            if sampler is not None:
+                return sampler
+
+            sampler = MapSampler(data, method)
+
+            with MapSampler.lock:
+                cache[key] = sampler
+                while len(cache) > MapSampler.cache_size:
+                    cache.popitem(last=False)
+                MapSampler.building.pop(key, None)
+
+        return sampler
+
+def inverse_transform_sampling_2d(data, n_samples, method="cdf", version=None, map_def=None):
+    """
+    Draw n_samples continuous (x, y) in [0, N] x [0, M] with density
+    proportional to data of shape [M, N], which is piecewise constant (i.e.
+    uniform inside each cell). method is either "cdf" (inverse transform
+    sampling with np.searchsorted) or "alias" (Walker's alias method, faster
+    per sample but more expensive to build). Tables are cached by map_def
+    (--map-def if None) and data, see MapSampler
+
+    version is deprecated, both of the former versions (1 and 2, also when
+    passed positionally) map to method="cdf"
+    """
+    if method in [1, 2]:
+        method, version = "cdf", method
+
+    if version is not None:
+        # Called on every reset, warn only once
+        if not getattr(inverse_transform_sampling_2d, "warned", False):
+            tf.logging.warn("inverse_transform_sampling_2d: version is deprecated, use method")
+            inverse_transform_sampling_2d.warned = True
+        method = "cdf"
+
+    xs, ys = MapSampler.get(data, method, map_def).sample(n_samples)
     return xs.squeeze(), ys.squeeze()
 
 def clip(x, min_v, max_v):
@@ -533,30 +1039,100 @@ def put_kernels_on_grid(kernel, pad = 1):
     # scaling to [0, 255] is not necessary for tensorboard
     return x7
 
-def to_image(R, K, interpolation=cv2.INTER_NEAREST):
+def to_image(R, K, interpolation=None):
+    import cv2
+    if interpolation is None:
+        interpolation = cv2.INTER_NEAREST
     R = normalize(R)
     R = cv2.resize(R, (R.shape[1] * K, R.shape[0] * K), interpolation=interpolation)[..., None]
     R = np.concatenate([R, R, R], axis=2)
     return R
 
-def compute_mean_steering_angle(reward):
-    rimg = to_image(reward, 20)
-    cv2.imshow("reward", rimg)
+def downsample_front_view(front_view, k):
+    """
+    Average pool front views [..., H, W, C] by k x k with stride k, the
+    remainder is dropped like VALID padding. NumPy twin of
+    drl.ac.models.preprocess_front_view
+    """
+    if k == 1:
+        return front_view
+
+    H, W, C = front_view.shape[-3:]
+    H, W = H // k * k, W // k * k
+
+    x = front_view[..., :H, :W, :]
+    x = x.reshape(x.shape[:-3] + (H // k, k, W // k, k, C))
+
+    return x.mean(axis=(-4, -2))
+
+# (H, W, downsample) -> steering angle table, see steering_angle_table
+steering_angle_tables = {}
 
-    H, W = reward.shape
-    yv, xv = np.meshgrid(range(H), range(W))
-    xv = xv.astype(np.float32)
-    yv = yv.astype(np.float32)
+def steering_angle_table(H, W, downsample=1):
+    """
+    Steering angle (in radians, right > 0) towards each cell of a H x W
+    front view, vehicle at the bottom center, pooled like the front view by
+    downsample_front_view. Computed once per observed shape
+    """
+    key = (H, W, downsample)
+
+    if key not in steering_angle_tables:
+        rows = np.arange(H, dtype=np.float64)[:, None]
+        cols = np.arange(W, dtype=np.float64)[None, :]
 
-    theta = np.arctan((yv - W / 2 + 0.5) / (H - xv))
+        theta = np.arctan((cols - (W - 1) / 2.) / (H - rows - 0.5))
+        theta = downsample_front_view(theta[..., None], downsample)[..., 0]
 
-    mean_steer = np.mean(theta * reward)
+        steering_angle_tables[key] = theta.astype(np.float32)
 
-    print "mean_steer = {} degree".format(mean_steer / np.pi * 180)
+    return steering_angle_tables[key]
 
-    cv2.imshow("theta", np.abs(theta))
-    cv2.waitKey(0)
-    sys.exit()
+def compute_mean_steering_angle(front_view, downsample=None):
+    """
+    Reward-weighted mean steering angle of front views [..., H, W, C] (or of
+    a single [H, W] reward map), returns [...]. NumPy twin of
+    drl.ac.models.naive_mean_steer_policy
+    """
+    front_view = np.asarray(front_view, np.float32)
+    if front_view.ndim == 2:
+        front_view = front_view[..., None]
+
+    downsample = downsample or FLAGS.graph_downsample
+
+    H, W = front_view.shape[-3:-1]
+    theta = steering_angle_table(H, W, downsample)[..., None]
+
+    # Substract min from front_view to make sure positivity
+    r = downsample_front_view(front_view, downsample)
+    r = r - np.min(r, axis=(-3, -2, -1), keepdims=True)
+
+    num   = np.sum(r * theta, axis=(-3, -2, -1))
+    denom = np.sum(r        , axis=(-3, -2, -1)) + 1e-10
+
+    return num / denom
+
+class NaiveSteerPolicy(object):
+    """
+    Steers towards the reward-weighted mean angle of the front view (see
+    compute_mean_steering_angle) and keeps other action dimensions at the
+    middle of action space. Needs no session, and has the same interface as
+    estimators used for acting, so it can stand in for a net as a baseline
+    or fallback controller (e.g. --eval-naive-policy)
+    """
+    # Index of steering in OffRoadNav actions
+    STEER = 1
+
+    def get_initial_hidden_states(self, batch_size):
+        return {}
+
+    def predict_actions(self, state, sess=None):
+        steer = compute_mean_steering_angle(state["front_view"]).ravel()
+
+        AS = FLAGS.action_space
+        action = np.tile(((AS.low + AS.high) / 2.)[:, None], (1, len(steer)))
+        action[self.STEER] = np.clip(steer, AS.low[self.STEER], AS.high[self.STEER])
+
+        return action.astype(np.float32), None, {}
 
 def sample_gumbel(shape, eps=1e-20):
     """Sample from Gumbel(0, 1)"""
@@ -629,44 +1205,22 @@ def compress_decompress_dict(rollout, fn):
         for k, v in rollout.iteritems()
     })
 
-class Timer(object):
-    def __init__(self, message, maxlen=1000):
-        self.timer = deque(maxlen=maxlen)
-        self.counter = 0
-        self.message = message
-
-    def tic(self):
-        self.t = time.time()
-
-    def toc(self):
-        self.timer.append(time.time() - self.t)
-
-        self.counter += 1
-        if self.counter % self.timer.maxlen == 0:
-            self.counter = 0
-            tf.logging.info("average time of {} = {:.2f} ms".format(
-                self.message, np.mean(self.timer) * 1000
-            ))
-
 class ReplayBuffer(deque):
 
-    def __init__(self, maxlen=None):
+    def __init__(self, maxlen=None, profiler=None):
         super(ReplayBuffer, self).__init__(maxlen=maxlen)
 
-        # keep last 1000 compress, decompress time for profiling purpose
-        self.timer = AttrDict(
-            compress = Timer("compress"),
-            decompress = Timer("decompress")
-        )
+        # profile compress, decompress time using the profiler of the worker
+        # that owns this buffer (if any)
+        self.profiler = profiler or Profiler("replay_buffer", enabled=False)
 
         self.counter = 0
 
     def append(self, item):
 
         if FLAGS.compress:
-            self.timer.compress.tic()
-            item = zlib.compress(cPickle.dumps(item, protocol=cPickle.HIGHEST_PROTOCOL))
-            self.timer.compress.toc()
+            with self.profiler.span("replay_compress"):
+                item = zlib.compress(cPickle.dumps(item, protocol=cPickle.HIGHEST_PROTOCOL))
 
             self.counter += 1
             if self.counter % self.maxlen == 0:
@@ -679,9 +1233,8 @@ class ReplayBuffer(deque):
         item = super(ReplayBuffer, self).__getitem__(key)
 
         if FLAGS.compress:
-            self.timer.decompress.tic()
-            item = cPickle.loads(zlib.decompress(item))
-            self.timer.decompress.toc()
+            with self.profiler.span("replay_decompress"):
+                item = cPickle.loads(zlib.decompress(item))
 
         return item
 
@@ -3,6 +3,8 @@ import itertools
 import numpy as np
 import tensorflow as tf
 from drl.ac.utils import *
+from drl.profiler import Profiler
+from drl.tracer import StepTracer
 FLAGS = tf.flags.FLAGS
 
 class Worker(object):
@@ -20,34 +22,85 @@ class Worker(object):
                  n_agents=1):
 
         self.name = name
+        self.global_net = global_net
+        self.add_summaries = add_summaries
+
+        # Get global variables
+        self.global_step = tf.contrib.framework.get_global_step()
+
+        # Create local policy/value nets that are not updated asynchronously.
+        # With --share-local-net, all workers run the global net instead, and
+        # LSTM states and behavior policy stats are passed only through feeds
+        if FLAGS.share_local_net:
+            self.local_net = global_net
+        else:
+            with tf.variable_scope(name):
+                self.local_net = self.Estimator(add_summaries)
+        self.set_global_net(global_net)
+
+        self.init_runtime(env, global_counter, global_episode_stats, n_agents)
+
+    def init_runtime(self, env, global_counter, global_episode_stats, n_agents=1):
+        """
+        Initialize everything that is not part of the TF graph. Also used to
+        re-create workers from a cached graph (see drl.graph_cache)
+        """
         self.env = env
         self.global_counter = global_counter
         self.global_episode_stats = global_episode_stats
-        self.global_net = global_net
-        self.add_summaries = add_summaries
         self.n_agents = n_agents
 
-        # Get global variables and flags
-        self.global_step = tf.contrib.framework.get_global_step()
+        # Get global flags
         self.discount_factor = FLAGS.discount_factor
         self.max_global_steps = FLAGS.max_global_steps
 
-        # Create local policy/value nets that are not updated asynchronously
-        with tf.variable_scope(name):
-            self.local_net = self.Estimator(add_summaries)
-        self.set_global_net(global_net)
+        # Time spent in each phase of the training cycle (if --profile)
+        self.profiler = Profiler(self.name)
+
+        # Trace selected steps op by op (if --trace-steps), only worker_0
+        self.tracer = StepTracer(self.name, FLAGS.trace_steps if self.add_summaries else None)
 
         # Initialize counter, maximum return of this worker, and summary_writer
         self.counter = 0
         self.max_return = 0
         self.summary_writer = None
 
+        # Set by drl.monitor.Monitor if --display
+        self.episode_feed = None
+
         # Assign each worker (thread) a memory replay buffer
-        self.replay_buffer = ReplayBuffer(maxlen=FLAGS.max_replay_buffer_size)
+        self.replay_buffer = ReplayBuffer(
+            maxlen=FLAGS.max_replay_buffer_size, profiler=self.profiler)
+
+    def build_copy_params_op(self, global_net):
+        # Nothing to copy when local net is the global net
+        if self.local_net is global_net:
+            return None
+        return make_copy_params_op(global_net.var_list, self.local_net.var_list)
+
+    def shared_op(self, key, build_fn):
+        """
+        Ops that don't depend on the worker (e.g. train ops when local net is
+        the global net) are built once and shared by all workers
+        """
+        if self.local_net is not self.global_net:
+            return build_fn()
+
+        if not hasattr(self.global_net, "shared_ops"):
+            self.global_net.shared_ops = {}
+
+        if key not in self.global_net.shared_ops:
+            self.global_net.shared_ops[key] = build_fn()
+
+        return self.global_net.shared_ops[key]
 
     def copy_params_from_global(self):
         # Copy Parameters from the global networks
-        self.sess.run(self.copy_params_op)
+        if self.copy_params_op is None:
+            return
+
+        with self.profiler.span("param_sync"):
+            self.sess.run(self.copy_params_op)
 
     def reset_env(self):
 
@@ -73,19 +126,24 @@ class Worker(object):
         env_state, action = self.reset_env()
         hidden_states = self.local_net.get_initial_hidden_states(self.n_agents)
 
+        profiler = self.profiler
+
         reward = np.zeros((1, self.n_agents), dtype=np.float32)
         for i in range(n_steps):
 
             # Note: state is "fully observable" state, it contains env.state,
             # lstm.hidden_states, and other things like prev_action and reward
-            state = form_state(self.env, env_state, action, reward, hidden_states)
+            with profiler.span("featurize"):
+                state = form_state(self.env, env_state, action, reward, hidden_states)
 
             # Predict an action
-            action, pi_stats, hidden_states = \
-                self.local_net.predict_actions(state, self.sess)
+            with profiler.span("predict_actions"):
+                action, pi_stats, hidden_states = \
+                    self.local_net.predict_actions(state, self.sess)
 
             # Take a step in environment
-            env_state, reward, done, _ = self.env.step(action.squeeze())
+            with profiler.span("simulation"):
+                env_state, reward, done, _ = self.env.step(action.squeeze())
             reward = np.array([reward], np.float32).reshape(1, self.n_agents)
             done = np.array(done).reshape(1, self.n_agents)
 
@@ -205,14 +263,14 @@ class Worker(object):
             states = {
                 k: np.concatenate(
                     [r.states[k] for r in rollouts],
-                    axis=(-2 if k is not "front_view" else 1)
+                    axis=(-2 if k != "front_view" else 1)
                 )
                 for k in rollouts[0].states.keys()
             },
             action = concat('action'),
             reward = concat('reward'),
             done = concat('done'),
-            pi_stats = {
+            pi_stats = None if rollouts[0].pi_stats is None else {
                 k: np.concatenate([r.pi_stats[k] for r in rollouts], axis=-2)
                 for k in rollouts[0].pi_stats.keys()
             },
@@ -248,15 +306,30 @@ class Worker(object):
 
         self.collect_statistics(rollout)
 
+        # Only seed and actions are needed to replay the episode in monitor
+        if self.episode_feed is not None:
+            self.episode_feed.publish(rollout.seed, rollout.action)
+
+        # Persist them too if --record-episodes, for offline rendering
+        if FLAGS.episode_recorder is not None:
+            FLAGS.episode_recorder.append(
+                self.name, rollout.seed, rollout.action, rollout.r)
+
         # Store rollout in the replay buffer, discard the oldest by popping
         # the 1st element if it exceeds maximum buffer size
         rp = self.replay_buffer
 
-        rp.append(rollout)
+        with self.profiler.span("replay_io"):
+            rp.append(to_storage_dtype(rollout))
 
         if len(rp) % 100 == 0 and len(rp) < FLAGS.max_replay_buffer_size:
             tf.logging.info("len(replay_buffer) = {}".format(len(rp)))
 
+    def should_summarize(self):
+        # self.counter is the number of updates performed by this worker
+        return self.summary_writer is not None and \
+            self.counter % FLAGS.summarize_every_n_steps == 0
+
     def should_stop(self):
 
         # Condition 1: maximum step reached
@@ -285,6 +358,7 @@ class Worker(object):
             try:
                 while not coord.should_stop() and not Worker.stop:
                     self._run()
+                    self.profiler.maybe_report(self.summary_writer, self.gstep)
             except tf.errors.CancelledError:
                 return
             except:
@@ -0,0 +1,126 @@
+import os
+import time
+import Queue
+import threading
+import numpy as np
+import tensorflow as tf
+FLAGS = tf.flags.FLAGS
+
+class CheckpointManager(object):
+    """
+    Asynchronous checkpointing. save() copies the values of all variables into
+    host memory with a single sess.run, and a background thread writes them to
+    <checkpoint_dir>/model-<step>.npz (through a temporary file and an atomic
+    rename), keeping only the newest max_to_keep checkpoints. The training
+    loop only pays for the snapshot, never for the disk.
+
+    Must be constructed before the graph is finalized, since it creates the
+    assign ops used by restore().
+    """
+    def __init__(self, var_list, checkpoint_dir, max_to_keep=10, prefix="model"):
+        self.var_list = list(sorted(var_list, key=lambda v: v.name))
+        self.checkpoint_dir = checkpoint_dir
+        self.max_to_keep = max_to_keep
+        self.prefix = prefix
+
+        with tf.name_scope("checkpoint_manager"):
+            self.placeholders = [
+                tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in self.var_list
+            ]
+            self.restore_op = tf.group(*[
+                v.assign(p) for v, p in zip(self.var_list, self.placeholders)
+            ])
+
+        # Pending snapshots, only one can wait while another is being written
+        self.queue = Queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def checkpoints(self):
+        """
+        Returns paths of all checkpoints sorted by global step (oldest first)
+        """
+        if not os.path.exists(self.checkpoint_dir):
+            return []
+
+        pattern = self.prefix + "-"
+        steps = [
+            int(f[len(pattern):-len(".npz")])
+            for f in os.listdir(self.checkpoint_dir)
+            if f.startswith(pattern) and f.endswith(".npz")
+        ]
+
+        return [self._path(step) for step in sorted(steps)]
+
+    def latest_checkpoint(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if len(checkpoints) > 0 else None
+
+    def _path(self, step):
+        return os.path.join(self.checkpoint_dir, "{}-{}.npz".format(self.prefix, step))
+
+    def save(self, sess, global_step, block=False):
+        t = time.time()
+        values, step = sess.run([self.var_list, global_step])
+        snapshot_time = time.time() - t
+
+        snapshot = (step, values, snapshot_time)
+
+        if block:
+            self.queue.put(snapshot)
+            return
+
+        try:
+            self.queue.put_nowait(snapshot)
+        except Queue.Full:
+            tf.logging.warn("\33[33mPrevious checkpoint is still being written, "
+                            "skip checkpoint of step {}\33[0m".format(step))
+
+    def _write_loop(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+
+            try:
+                self._write(*snapshot)
+            except Exception as e:
+                tf.logging.error("\33[31mFailed to write checkpoint: {}\33[0m".format(e))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, step, values, snapshot_time):
+        t = time.time()
+
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+        fn = self._path(step)
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, 'wb') as f:
+            np.savez(f, **{v.name: value for v, value in zip(self.var_list, values)})
+        os.rename(tmp_fn, fn)
+
+        # Retention policy: only keep the newest max_to_keep checkpoints
+        for old in self.checkpoints()[:-self.max_to_keep]:
+            os.remove(old)
+
+        tf.logging.info("model saved to {} (snapshot {:.1f} ms, write {:.1f} ms)".format(
+            fn, snapshot_time * 1000, (time.time() - t) * 1000))
+
+    def restore(self, sess, path):
+        with np.load(path) as data:
+            feed_dict = {
+                p: data[v.name] for v, p in zip(self.var_list, self.placeholders)
+            }
+        sess.run(self.restore_op, feed_dict)
+
+    def wait(self):
+        # Block until all pending snapshots are on disk
+        self.queue.join()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
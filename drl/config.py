@@ -9,7 +9,9 @@ tf.flags.DEFINE_integer("random-seed", None, "Random seed for gym.env and Tensor
 tf.flags.DEFINE_string("base-dir", "exp/", "Directory to write Tensorboard summaries and models to.")
 tf.flags.DEFINE_string("exp", None, "Optional experiment tag")
 tf.flags.DEFINE_string("log-file", None, "log file")
-tf.flags.DEFINE_string("stats-file", None, "stats file")
+tf.flags.DEFINE_string("stats-file", None, "directory to stream episode statistics to (see drl.ac.utils.load_statistics)")
+tf.flags.DEFINE_boolean("async-logging", True, "Write log file from a background thread")
+tf.flags.DEFINE_float("log-update-every-n-seconds", 5, "Log losses of A3C updates at most once every N seconds per worker")
 tf.flags.DEFINE_string("game", None, "Game environment. Ex: Humanoid-v1, OffRoadNav-v0")
 tf.flags.DEFINE_string("estimator-type", "ACER", "Choose A3C or ACER")
 tf.flags.DEFINE_string("qprop-type", "adaptive", "Choose \"adaptive\", \"conservative\", or \"aggressive\"")
@@ -28,13 +30,22 @@ tf.flags.DEFINE_boolean("staircase", False, "Set exponential_decay with staircas
 tf.flags.DEFINE_boolean("use-lstm", True, "Use LSTM when set True")
 tf.flags.DEFINE_boolean("batch-norm", False, "Use batch norm whenever possible")
 tf.flags.DEFINE_boolean("double-precision", False, "Use tf.float64")
+tf.flags.DEFINE_string("accumulate-precision", None, "Dtype of numerically sensitive parts (Retrace recursion, TRPO projection), e.g. float64. Defaults to the compute dtype")
+tf.flags.DEFINE_string("storage-precision", None, "Dtype of observations stored in replay buffer, e.g. float16 or uint8. By default, observations wider than the compute dtype are downcast to it and others are stored as is. LSTM hidden states always follow the default")
 tf.flags.DEFINE_boolean("summarize", False, "Create summary writer")
+tf.flags.DEFINE_integer("summarize-every-n-steps", 10, "Evaluate and write summaries every N updates of worker_0")
+tf.flags.DEFINE_integer("summary-flush-secs", 120, "Flush summaries to disk every N seconds (from a background thread)")
+tf.flags.DEFINE_integer("summary-max-queue", 100, "Maximum number of pending summaries before add_summary blocks")
 tf.flags.DEFINE_boolean("debug-dump", False, "dump debugging information to *.mat file")
+tf.flags.DEFINE_boolean("cache-featurizer", True, "Cache fitted state featurizer under base-dir and reuse it across runs")
+tf.flags.DEFINE_boolean("cache-graph", False, "Cache the built graph under base-dir and reuse it in runs that differ only in non-graph flags (e.g. learning rate, replay ratio)")
 
 tf.flags.DEFINE_integer("log-episode-stats-every-nth", 20, "Print stats of episode every nth")
 tf.flags.DEFINE_integer("parallelism", 1, "Number of threads to run. If not set we run [num_cpu_cores] threads.")
+tf.flags.DEFINE_boolean("share-local-net", False, "If set, all workers run the graph of global net (per-worker states are fed) and apply gradients to it directly, instead of each building a local copy")
 tf.flags.DEFINE_integer("save-every-n-minutes", 10, "Save model every N minutes")
 tf.flags.DEFINE_integer("off-policy-batch-size", 1, "batch rollouts when performing off-policy updates")
+tf.flags.DEFINE_integer("on-policy-batch-size", 1, "batch rollouts when performing on-policy (A3C) updates")
 
 tf.flags.DEFINE_float("replay-ratio", 10, "off-policy memory replay ratio, choose a number from {0, 1, 4, 8}")
 tf.flags.DEFINE_integer("max-replay-buffer-size", 100, "off-policy memory replay buffer")
@@ -44,7 +55,8 @@ tf.flags.DEFINE_integer("regenerate-size", 1000, "number of episodes experience
 
 tf.flags.DEFINE_float("avg-net-momentum", 0.995, "soft update momentum for average policy network in TRPO")
 tf.flags.DEFINE_float("importance-weight-truncation-threshold", 5, "soft update momentum for average policy network in TRPO")
-tf.flags.DEFINE_boolean("mixture-model", False, "Use single Gaussian if set to True, use GMM otherwise")
+tf.flags.DEFINE_boolean("mixture-model", False, "If set, use a mixture of --num-mixtures Gaussians (GMM) as policy, single Gaussian otherwise. Only for --policy-dist Gaussian")
+tf.flags.DEFINE_integer("num-mixtures", 3, "Number of components of the GMM policy")
 tf.flags.DEFINE_string("policy-dist", "Gaussian", "Either Gaussian, Beta, or StudentT")
 tf.flags.DEFINE_integer("bucket-width", 10, "bucket_width")
 tf.flags.DEFINE_integer("num-sdn-samples", 8, "soft update momentum for average policy network in TRPO")
@@ -53,7 +65,16 @@ tf.flags.DEFINE_boolean("share-network", True, "If set, value net and policy net
 tf.flags.DEFINE_boolean("bi-directional", False, "If set, use bi-directional RNN/LSTM")
 tf.flags.DEFINE_boolean("reset", False, "If set, delete the existing model directory and start training from scratch.")
 tf.flags.DEFINE_boolean("display", True, "If set, no imshow will be called")
+tf.flags.DEFINE_integer("eval-every-n-minutes", None, "If set, evaluate a snapshot of global net every n minutes in separate processes")
+tf.flags.DEFINE_integer("eval-episodes", 16, "Number of episodes per evaluation")
+tf.flags.DEFINE_integer("eval-processes", 2, "Number of evaluation processes")
+tf.flags.DEFINE_boolean("eval-naive-policy", False, "If set, evaluate the naive mean-steer policy (OffRoadNav only) instead of global net, as a baseline")
+tf.flags.DEFINE_boolean("record-episodes", False, "If set, save seed and actions of every episode under <exp-dir>/episodes for offline rendering (see render.py)")
 tf.flags.DEFINE_boolean("show-memory-usage", False, "If set, show memory usage during training")
+tf.flags.DEFINE_boolean("profile", False, "If set, time each phase of the training cycle in every worker")
+tf.flags.DEFINE_integer("profile-every-n-seconds", 60, "Log and summarize profiling results every N seconds")
+tf.flags.DEFINE_string("trace-steps", None, "Comma separated global steps to run with FULL_TRACE and dump Chrome trace to debug-dir")
+tf.flags.DEFINE_string("trace-scopes", "Q_Retrace,A,losses,shared,grads_and_optimizer", "Comma separated name scopes to aggregate traced op time by")
 tf.flags.DEFINE_boolean("resume", False, "If set, resume training from the corresponding last checkpoint file")
 tf.flags.DEFINE_boolean("debug", False, "If set, turn on the debug flag")
 tf.flags.DEFINE_boolean("dump-crash-report", False, "If set, dump mdp_states and internal TF variables when crashed.")
@@ -81,7 +102,8 @@ tf.flags.DEFINE_float("lambda_", 0.95, "lambda in TD-Lambda (temporal difference
 tf.flags.DEFINE_string("map-def", "map0", "map definition file in *.yaml format for OffRoadNav-v0")
 tf.flags.DEFINE_float("command-freq", 20, "How frequent we send command to vehicle (in Hz)")
 tf.flags.DEFINE_integer("field-of-view", 20, "size of front view (N x N) passed to network")
-tf.flags.DEFINE_integer("downsample", 1, "downsample front view by this scale")
+tf.flags.DEFINE_integer("downsample", 1, "downsample front view by this scale (read by OffRoadNav)")
+tf.flags.DEFINE_integer("graph-downsample", 1, "further downsample the front view observed from env by this scale, by average pooling in graph")
 tf.flags.DEFINE_integer("n-agents-per-worker", 1, "number of agents per worker thread")
 tf.flags.DEFINE_integer("viewport-scale", 4, "number of agents per worker thread")
 tf.flags.DEFINE_boolean("drift", False, "If set, turn on drift")
@@ -113,8 +135,20 @@ def parse_flags():
     FLAGS.checkpoint_dir = FLAGS.exp_dir + "/checkpoint"
     FLAGS.save_path      = FLAGS.checkpoint_dir + "/model"
     FLAGS.debug_dir      = FLAGS.exp_dir + "/debug"
+    FLAGS.cache_dir      = FLAGS.base_dir + "/cache"
+    FLAGS.episodes_dir   = FLAGS.exp_dir + "/episodes"
+    FLAGS.videos_dir     = FLAGS.exp_dir + "/videos"
 
+    # Created by train.py if --record-episodes
+    FLAGS.episode_recorder = None
+
+    # Precision policy: networks (parameters and compute) use FLAGS.dtype,
+    # numerically sensitive accumulations FLAGS.accumulate_dtype, and observations
+    # in replay buffer are stored as FLAGS.storage_dtype (a NumPy dtype, None
+    # means never upcast, see to_storage_dtype)
     FLAGS.dtype = tf.float64 if FLAGS.double_precision else tf.float32
+    FLAGS.accumulate_dtype = tf.as_dtype(FLAGS.accumulate_precision or FLAGS.dtype)
+    FLAGS.storage_dtype = np.dtype(FLAGS.storage_precision) if FLAGS.storage_precision else None
 
     from drl.ac.utils import AttrDict, mkdir_p
 
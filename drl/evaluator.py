@@ -0,0 +1,211 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+FLAGS = tf.flags.FLAGS
+
+# Per-process state of evaluation processes, see init_eval_process
+net = None
+sess = None
+envs = None
+restore = None
+
+def init_eval_process(n_envs):
+    """
+    Build a CPU-only copy of global net (or NaiveSteerPolicy if
+    --eval-naive-policy) and n_envs envs in this (forked) evaluation
+    process, once
+    """
+    global net, sess, envs, restore
+
+    import gym
+
+    envs = [gym.make(FLAGS.game) for i in range(n_envs)]
+
+    if FLAGS.eval_naive_policy:
+        from drl.ac.utils import NaiveSteerPolicy
+        net = NaiveSteerPolicy()
+        restore = lambda params: None
+        return
+
+    from drl.ac.estimators import get_estimator
+    from drl.ac.acer.estimators import AcerEstimator
+    from drl.ac.utils import create_global_variables
+
+    graph = tf.Graph()
+    with graph.as_default():
+
+        # average_net is cached on the class, it belongs to parent's graph
+        if "average_net" in AcerEstimator.__dict__:
+            del AcerEstimator.average_net
+
+        create_global_variables()
+
+        Estimator = get_estimator(FLAGS.estimator_type)
+        with tf.variable_scope("global_net"):
+            net = Estimator(trainable=False)
+
+        placeholders = {
+            v.name: tf.placeholder(v.dtype.base_dtype, v.get_shape())
+            for v in net.var_list
+        }
+        restore_op = tf.group(*[v.assign(placeholders[v.name]) for v in net.var_list])
+
+        init_op = tf.global_variables_initializer()
+
+    # Don't compete with training for GPU and cores
+    cfg = tf.ConfigProto(
+        device_count={'GPU': 0},
+        intra_op_parallelism_threads=1,
+        inter_op_parallelism_threads=1)
+    sess = tf.Session(graph=graph, config=cfg)
+    sess.run(init_op)
+    graph.finalize()
+
+    def restore(params):
+        sess.run(restore_op, {placeholders[k]: v for k, v in params.iteritems()})
+
+def run_episodes(envs):
+    """
+    Run one episode in each env in lockstep, actions of all envs are computed
+    by one batched sess.run per step. Returns total returns and lengths
+    """
+    from drl.ac.utils import form_state
+
+    n_agents = FLAGS.n_agents_per_worker
+    N = len(envs)
+
+    env_states = [env.reset() for env in envs]
+    actions = [np.zeros((FLAGS.num_actions, n_agents), np.float32) for i in range(N)]
+    rewards = [np.zeros((1, n_agents), np.float32) for i in range(N)]
+    hidden_states = [net.get_initial_hidden_states(n_agents) for i in range(N)]
+
+    total_returns = np.zeros((N, n_agents), np.float32)
+    lengths = np.zeros(N, np.int32)
+    alive = np.ones(N, np.bool)
+
+    for t in range(FLAGS.max_steps):
+        indices = np.flatnonzero(alive)
+        if len(indices) == 0:
+            break
+
+        # Stack states of all alive envs along batch axis
+        states = [
+            form_state(envs[i], env_states[i], actions[i], rewards[i], hidden_states[i])
+            for i in indices
+        ]
+        state = {
+            k: np.concatenate([s[k] for s in states]) for k in states[0].keys()
+        }
+
+        action, _, hidden = net.predict_actions(state, sess)
+
+        for j, i in enumerate(indices):
+            s = slice(j * n_agents, (j + 1) * n_agents)
+            actions[i] = action[:, s]
+            hidden_states[i] = {k: v[s] for k, v in hidden.iteritems()}
+
+            env_states[i], reward, done, _ = envs[i].step(actions[i].squeeze())
+            rewards[i] = np.array([reward], np.float32).reshape(1, n_agents)
+
+            total_returns[i] += rewards[i][0]
+            lengths[i] += 1
+            alive[i] = not np.any(done)
+
+    return np.mean(total_returns, axis=1), lengths
+
+def evaluate_episodes(args):
+    params, n_episodes = args
+
+    restore(params)
+
+    returns, lengths = [], []
+    while len(returns) < n_episodes:
+        r, l = run_episodes(envs[:n_episodes - len(returns)])
+        returns.extend(r)
+        lengths.extend(l)
+
+    return returns, lengths
+
+class Evaluator(object):
+    """
+    Evaluates snapshots of global net in a pool of processes, so evaluation
+    competes with training workers neither for the session nor for the GIL.
+    Must be created before any tf.Session since the pool is forked.
+
+    evaluate() only copies the parameters (one sess.run) and returns. When
+    all --eval-episodes are done, mean and percentiles of returns are written
+    to TensorBoard (eval/*) and <exp-dir>/evaluation.csv
+    """
+    def __init__(self, n_episodes=None, n_processes=None, envs_per_process=None):
+        self.n_episodes = n_episodes or FLAGS.eval_episodes
+        self.n_processes = n_processes or FLAGS.eval_processes
+        envs_per_process = envs_per_process or int(np.ceil(
+            float(self.n_episodes) / self.n_processes))
+
+        self.pool = multiprocessing.Pool(
+            self.n_processes, initializer=init_eval_process,
+            initargs=(envs_per_process,))
+
+        self.pending = None
+
+    def evaluate(self, sess, var_list, global_step, summary_writer=None):
+
+        if self.pending is not None and not self.pending.ready():
+            tf.logging.warn("\33[33mPrevious evaluation is still running, skipped\33[0m")
+            return
+
+        values, step = sess.run([var_list, global_step])
+        params = {v.name: value for v, value in zip(var_list, values)}
+
+        # Split episodes evenly over processes
+        chunks = np.diff(np.linspace(0, self.n_episodes, self.n_processes + 1).astype(np.int32))
+        tasks = [(params, n) for n in chunks if n > 0]
+
+        t = time.time()
+        def callback(results):
+            try:
+                self.report(results, step, time.time() - t, summary_writer)
+            except Exception as e:
+                tf.logging.error("\33[31mFailed to report evaluation: {}\33[0m".format(e))
+
+        self.pending = self.pool.map_async(evaluate_episodes, tasks, callback=callback)
+
+    def report(self, results, step, seconds, summary_writer=None):
+        returns = np.concatenate([r for r, l in results])
+        lengths = np.concatenate([l for r, l in results])
+
+        stats = [
+            ("mean_return", np.mean(returns)),
+            ("p10_return", np.percentile(returns, 10)),
+            ("p50_return", np.percentile(returns, 50)),
+            ("p90_return", np.percentile(returns, 90)),
+            ("mean_length", np.mean(lengths)),
+        ]
+
+        tf.logging.info("\33[96m[eval @ step {}]\33[0m {} episodes in {:.1f} s, ".format(
+            step, len(returns), seconds) + ", ".join([
+                "{} = {:.2f}".format(k, v) for k, v in stats]))
+
+        if summary_writer is not None:
+            summary = tf.Summary()
+            for k, v in stats:
+                summary.value.add(tag="eval/" + k, simple_value=v)
+            summary_writer.add_summary(summary, step)
+
+        # Next to (not inside) --stats-file, which StatsWriter owns
+        if not os.path.exists(FLAGS.exp_dir):
+            os.makedirs(FLAGS.exp_dir)
+
+        fn = os.path.join(FLAGS.exp_dir, "evaluation.csv")
+        new_file = not os.path.exists(fn)
+        with open(fn, 'a') as f:
+            if new_file:
+                f.write(",".join(["step", "timestamp"] + [k for k, v in stats]) + "\n")
+            f.write(",".join(map(str, [step, time.time()] + [v for k, v in stats])) + "\n")
+
+    def close(self):
+        # Let the last evaluation finish and report
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,247 @@
+import os
+import json
+import types
+import hashlib
+import threading
+import importlib
+import numpy as np
+import tensorflow as tf
+from drl.ac.utils import AttrDict
+FLAGS = tf.flags.FLAGS
+
+# Flags whose value ends up in the TF graph (shapes, constants, structure).
+# Flags not listed here (e.g. learning rate, replay ratio) can be changed
+# without rebuilding the graph.
+GRAPH_FLAGS = [
+    "game", "estimator_type", "policy_dist", "mixture_model", "num_mixtures", "parallelism",
+    "seq_length", "batch_size", "hidden_size", "use_lstm", "bi_directional",
+    "share_local_net",
+    "share_network", "batch_norm", "double_precision", "debug", "summarize",
+    "num_sdn_samples", "field_of_view", "downsample", "graph_downsample", "train_value_scale",
+    "bootstrap", "discount_factor", "lambda_", "entropy_cost_mult", "bucket_width",
+    "accumulate_precision",
+    "lr_vp_ratio", "importance_weight_truncation_threshold",
+    "avg_net_momentum", "max_gradient", "l2_reg", "decay_steps", "decay_rate",
+    "staircase", "map_def", "qprop_type",
+]
+
+# Attributes that can't be cached and are re-created by the caller (see
+# Worker.init_runtime and import_training_graph). Any other attribute that
+# can't be cached is skipped with a warning
+RUNTIME_ATTRS = [
+    "env", "global_counter", "global_episode_stats", "profiler", "tracer",
+    "summary_writer", "episode_feed", "replay_buffer", "lock",
+]
+
+# Graph handles created in train.py and shared through FLAGS
+RUNTIME_HANDLES = [
+    "global_step", "global_timestep", "global_timestep_placeholder",
+    "set_time_op", "learning_rate_var"
+]
+
+def source_digest():
+    # Any change in the code building the graph invalidates the cache
+    root = os.path.dirname(os.path.abspath(__file__))
+    md5 = hashlib.md5()
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.endswith(".py"):
+                with open(os.path.join(dirpath, fn), 'rb') as f:
+                    md5.update(f.read())
+    return md5.hexdigest()
+
+def graph_key():
+    flags = [(k, getattr(FLAGS, k)) for k in GRAPH_FLAGS]
+    env = [
+        ("num_actions", FLAGS.num_actions), ("num_states", FLAGS.num_states),
+        ("observation_space", str(FLAGS.observation_space)),
+        ("action_space", repr((FLAGS.action_space.low.tolist(), FLAGS.action_space.high.tolist()))),
+    ]
+    key = repr(flags + env) + source_digest()
+    return hashlib.md5(key).hexdigest()[:16]
+
+def graph_cache_path():
+    return "{}/graph-{}-{}".format(FLAGS.cache_dir, FLAGS.game, graph_key())
+
+class HandleSerializer(object):
+    """
+    Converts Python objects holding graph handles (estimators, workers) to a
+    JSON-able structure of tensor/op/variable names and back. Attributes that
+    can't be represented (closures, locks, envs, ...) are skipped: silently if
+    listed in RUNTIME_ATTRS, which the caller re-creates, and with a warning
+    naming the attribute otherwise.
+    """
+    def __init__(self, object_types):
+        self.object_types = tuple(object_types)
+
+    def dump(self, x):
+        self.memo = {}
+        self.skipped = set()
+        return self._dump(x, "")
+
+    def skip(self, path, k, v):
+        # Path is qualified by class instead of instance, warn once per attribute
+        path = "{}.{}".format(path, k) if path else str(k)
+        if k not in RUNTIME_ATTRS and path not in self.skipped:
+            self.skipped.add(path)
+            tf.logging.warn("Graph cache: skipped {} ({}), it will be missing "
+                            "when the graph is imported".format(path, type(v).__name__))
+
+    def _dump(self, x, path):
+        if isinstance(x, tf.Variable):
+            return {"__var__": x.name}
+        if isinstance(x, tf.Tensor):
+            return {"__tensor__": x.name}
+        if isinstance(x, tf.Operation):
+            return {"__op__": x.name}
+        if x is None or isinstance(x, (bool, int, long, float, basestring)):
+            return {"__value__": x}
+        if isinstance(x, (np.ndarray, np.generic)):
+            return {"__ndarray__": np.asarray(x).tolist(), "dtype": x.dtype.str,
+                    "scalar": isinstance(x, np.generic)}
+        if isinstance(x, (type, types.ClassType)):
+            if x.__module__.startswith("drl."):
+                return {"__class__": x.__module__ + "." + x.__name__}
+            raise TypeError(x)
+        if isinstance(x, dict):
+            d = {}
+            for k, v in x.iteritems():
+                try:
+                    d[str(k)] = self._dump(v, "{}.{}".format(path, k) if path else str(k))
+                except TypeError:
+                    self.skip(path, k, v)
+            return {"__dict__": d, "__attrdict__": isinstance(x, AttrDict)}
+        if isinstance(x, (list, tuple)):
+            # Sequences are all-or-nothing, otherwise positions would shift
+            return {"__list__": [self._dump(v, path) for v in x], "__tuple__": isinstance(x, tuple)}
+        if isinstance(x, self.object_types):
+            if id(x) not in self.memo:
+                self.memo[id(x)] = None
+                self.memo[id(x)] = {
+                    "class": x.__class__.__module__ + "." + x.__class__.__name__,
+                    "attrs": self._dump(vars(x), x.__class__.__name__)["__dict__"]
+                }
+            return {"__ref__": str(id(x))}
+        raise TypeError(x)
+
+    def dumps(self, **roots):
+        handles = self.dump(roots)
+        return json.dumps({"roots": handles, "objects": self.memo})
+
+    def loads(self, s, graph=None):
+        graph = graph or tf.get_default_graph()
+        data = json.loads(s)
+        variables = {v.name: v for v in tf.global_variables() + tf.local_variables()}
+
+        def import_class(name):
+            module, cls = name.rsplit(".", 1)
+            return getattr(importlib.import_module(module), cls)
+
+        def new_instance(cls):
+            # Bypass __init__, which is what builds the graph
+            if isinstance(cls, types.ClassType):
+                return types.InstanceType(cls)
+            return cls.__new__(cls)
+
+        # Create all objects first so that references (even cyclic) resolve
+        objects = {
+            k: new_instance(import_class(str(v["class"])))
+            for k, v in data["objects"].iteritems()
+        }
+
+        def load(x):
+            if "__var__" in x:
+                return variables[x["__var__"]]
+            if "__tensor__" in x:
+                return graph.get_tensor_by_name(x["__tensor__"])
+            if "__op__" in x:
+                return graph.get_operation_by_name(x["__op__"])
+            if "__value__" in x:
+                v = x["__value__"]
+                return str(v) if isinstance(v, unicode) else v
+            if "__ndarray__" in x:
+                v = np.array(x["__ndarray__"], dtype=str(x["dtype"]))
+                return v[()] if x["scalar"] else v
+            if "__class__" in x:
+                return import_class(str(x["__class__"]))
+            if "__dict__" in x:
+                d = {str(k): load(v) for k, v in x["__dict__"].iteritems()}
+                return AttrDict(d) if x["__attrdict__"] else d
+            if "__list__" in x:
+                l = [load(v) for v in x["__list__"]]
+                return tuple(l) if x["__tuple__"] else l
+            if "__ref__" in x:
+                return objects[x["__ref__"]]
+            raise ValueError(x)
+
+        for k, v in data["objects"].iteritems():
+            for attr, value in v["attrs"].iteritems():
+                setattr(objects[k], str(attr), load(value))
+
+        return load(data["roots"])
+
+def export_graph(path, serializer, **roots):
+    """
+    Export the current default graph and handles of the given root objects
+    """
+    tf.train.export_meta_graph(filename=path + ".meta", clear_devices=True)
+
+    # Write handles last, its presence means the cache entry is complete
+    tmp = path + ".json.tmp"
+    with open(tmp, 'w') as f:
+        f.write(serializer.dumps(**roots))
+    os.rename(tmp, path + ".json")
+
+def import_graph(path, serializer):
+    """
+    Import a graph exported by export_graph into the current default graph and
+    return the re-bound root objects, or None if there's no such cache entry
+    """
+    if not os.path.exists(path + ".json"):
+        return None
+
+    tf.train.import_meta_graph(path + ".meta", clear_devices=True)
+
+    with open(path + ".json") as f:
+        return serializer.loads(f.read())
+
+def export_training_graph(Estimator, global_net, workers):
+    """
+    Cache the graph built by train.py, together with global_net, workers and
+    the graph handles kept in FLAGS
+    """
+    if not os.path.exists(FLAGS.cache_dir):
+        os.makedirs(FLAGS.cache_dir)
+
+    path = graph_cache_path()
+    tf.logging.info("Saving graph to {} ...".format(path))
+
+    export_graph(
+        path, HandleSerializer([Estimator, workers[0].__class__]),
+        global_net = global_net,
+        workers = workers,
+        average_net = Estimator.__dict__.get("average_net"),
+        flags = {k: getattr(FLAGS, k) for k in RUNTIME_HANDLES},
+    )
+
+def import_training_graph(Estimator, Worker):
+    """
+    Counterpart of export_training_graph. Returns (global_net, workers), or
+    None if the graph has to be built. Workers still need init_runtime()
+    """
+    path = graph_cache_path()
+    roots = import_graph(path, HandleSerializer([Estimator, Worker]))
+    if roots is None:
+        return None
+
+    tf.logging.info("Reusing graph from {}".format(path))
+
+    for k, v in roots["flags"].iteritems():
+        setattr(FLAGS, k, v)
+
+    if roots["average_net"] is not None:
+        Estimator.average_net = roots["average_net"]
+        Estimator.average_net.lock = threading.Lock()
+
+    return roots["global_net"], roots["workers"]
@@ -1,7 +1,11 @@
 import os
 import gym
-import inspect
+import sys
+import time
+import Queue
+import atexit
 import logging
+import threading
 import tensorflow as tf
 from ac.utils import mkdir_p
 FLAGS = tf.flags.FLAGS
@@ -16,6 +20,82 @@ tf.logging.set_verbosity(tf.logging.INFO)
 fmt = logging.Formatter('[%(asctime)s] %(message)s', datefmt="%m-%d %H:%M:%S")
 tf.logging._handler.setFormatter(fmt)
 
+class CallerFilter(logging.Filter):
+    """
+    Records not logged through the functions below (e.g. tf.logging.log_every_n)
+    don't carry file/line, give them a placeholder so formatting won't fail
+    """
+    def filter(self, record):
+        if not hasattr(record, 'file'):
+            record.file, record.line = record.filename, record.lineno
+        return True
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records over to a background thread which writes them with the
+    wrapped handler, so that hot paths never wait for (slow) file I/O.
+    Records that don't fit in the queue are dropped and counted, the count is
+    written as a warning once the thread catches up.
+    """
+    def __init__(self, handler, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.maxsize = maxsize
+        self._start()
+        atexit.register(self.stop)
+
+    def _start(self):
+        # Processes forked later (monitor, evaluator, render pool) inherit
+        # neither the thread nor locks in a usable state, so they start over
+        self.pid = os.getpid()
+        self.createLock()
+        self.handler.createLock()
+        self.queue = Queue.Queue(maxsize=self.maxsize)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        return logging.Handler.handle(self, record)
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def _consume(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handler.handle(record)
+            if self.dropped:
+                self._report_dropped()
+
+    def _report_dropped(self):
+        with self.dropped_lock:
+            n, self.dropped = self.dropped, 0
+        if n:
+            self.handler.handle(logging.makeLogRecord({
+                'name': tf.logging._logger.name, 'levelno': logging.WARN,
+                'levelname': 'WARNING', 'file': __file__, 'line': 0,
+                'msg': "Log queue is full, dropped {} records".format(n)
+            }))
+
+    def stop(self):
+        if self.pid != os.getpid():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self._report_dropped()
+        self.handler.flush()
+
 # Use the same format and dump it to log file
 if FLAGS.log_file is not None:
     mkdir_p(FLAGS.log_dir)
@@ -24,22 +104,55 @@ if FLAGS.log_file is not None:
     fh = logging.FileHandler(FLAGS.log_file)
     fmt = logging.Formatter('[%(asctime)s %(file)s:%(line)s] %(message)s')
     fh.setFormatter(fmt)
+    fh.addFilter(CallerFilter())
+
+    if FLAGS.async_logging:
+        fh = QueueHandler(fh)
+
     tf.logging._logger.addHandler(fh)
 
     FLAGS.stats_file = FLAGS.log_dir + FLAGS.stats_file
 
 cwd = os.getcwd() + "/"
 
+def _log(level, msg, depth):
+    # Look up the caller only when the record is actually going to be emitted
+    frame = sys._getframe(depth)
+    filename = frame.f_code.co_filename.replace(cwd, "")
+    tf.logging._logger.log(level, msg, extra={ 'file': filename, 'line': frame.f_lineno })
+
 def my_logger_factory(level):
 
     def log(msg):
-        _, filename, line, function_name, _, _ = inspect.getouterframes(
-            inspect.currentframe())[1]
-        filename = filename.replace(cwd, "")
-        tf.logging._logger.log(level, msg, extra={ 'file': filename, 'line': line })
+        if tf.logging._logger.isEnabledFor(level):
+            _log(level, msg, 2)
 
     return log
 
 tf.logging.info = my_logger_factory(tf.logging.INFO)
 tf.logging.warn = my_logger_factory(tf.logging.WARN)
 tf.logging.error = my_logger_factory(tf.logging.ERROR)
+
+_last_logged = {}
+
+def log_every_n_seconds(level, msg, n_seconds, key=None):
+    """
+    Rate-limited logging for hot paths: log msg at most once every n_seconds
+    per call site (and per key, e.g. worker name). msg can be a callable so
+    that formatting is skipped too
+    """
+    if not tf.logging._logger.isEnabledFor(level):
+        return
+
+    frame = sys._getframe(1)
+    key = (frame.f_code.co_filename, frame.f_lineno, key)
+
+    now = time.time()
+    if now - _last_logged.get(key, 0) < n_seconds:
+        return
+    _last_logged[key] = now
+
+    if callable(msg):
+        msg = msg()
+
+    _log(level, msg, 2)
@@ -1,74 +1,154 @@
 import gym
 import time
-import Queue
+import threading
+import numpy as np
 import multiprocessing
 import tensorflow as tf
 FLAGS = tf.flags.FLAGS
 
-# Global method take take a queue "q" as input, consume data in the queue
-# aggressively (i.e. get_nowait()), set the random seed, and replay those
-# actions and render.
-def renderer(q):
+class EpisodeFeed(object):
+    """
+    Ring of the latest (seed, actions) records in shared memory. Replaying an
+    episode only needs the seed and the actions, so workers publish just that
+    (a memcpy of a few KB) and the renderer process reads it without any
+    pickling or proxy server in between.
+
+    Each slot has a version number which is odd while the slot is being
+    written (a seqlock), so the reader can detect and skip torn records.
+    Must be created before the renderer process is forked, which happens
+    before tf.contrib is imported and before any env exists, so it's sized by
+    flags only: each step holds at most max_action_size floats, and the
+    action shape of each record is stored along with it.
+    """
+    def __init__(self, n_slots=8, max_steps=None, max_action_size=None):
+        self.n_slots = n_slots
+        self.max_steps = max_steps or FLAGS.max_steps
+        self.max_action_size = max_action_size or FLAGS.n_agents_per_worker * 16
+        self.slot_size = self.max_steps * self.max_action_size
+
+        self.actions  = multiprocessing.RawArray('f', n_slots * self.slot_size)
+        self.shapes   = multiprocessing.RawArray('i', n_slots * 2)
+        self.seeds    = multiprocessing.RawArray('L', n_slots)
+        self.lengths  = multiprocessing.RawArray('i', n_slots)
+        self.versions = multiprocessing.RawArray('L', n_slots)
+
+        # Number of records published so far, and whether the reader should stop
+        self.head = multiprocessing.RawValue('L', 0)
+        self.stopped = multiprocessing.RawValue('i', 0)
+
+        # Workers are threads of the same process
+        self.lock = threading.Lock()
+
+    def _slot(self, i):
+        actions = np.ctypeslib.as_array(self.actions)
+        return actions[i * self.slot_size:(i + 1) * self.slot_size]
+
+    def publish(self, seed, action):
+        """
+        seed is what env.seed() returned, action has shape
+        [S, n_agents, num_actions]
+        """
+        length = min(len(action), self.max_steps)
+        action = np.asarray(action[:length], dtype=np.float32)
+
+        if action[0].size > self.max_action_size:
+            tf.logging.warn("\33[33mActions of {} floats per step don't fit in the monitor feed, skipped\33[0m".format(action[0].size))
+            return
+
+        with self.lock:
+            i = self.head.value % self.n_slots
+
+            self.versions[i] += 1
+            self._slot(i)[:action.size] = action.ravel()
+            self.shapes[2 * i:2 * i + 2] = list(action.shape[1:])
+            self.seeds[i] = seed[0] if isinstance(seed, (list, tuple)) else seed
+            self.lengths[i] = length
+            self.versions[i] += 1
+
+            self.head.value += 1
+
+    def latest(self, last_seen=0):
+        """
+        Returns (record, head). record is None if there's nothing newer than
+        last_seen (head value of the previous call) or the slot is being
+        overwritten, try again later in that case
+        """
+        head = self.head.value
+        if head == last_seen:
+            return None, last_seen
+
+        i = (head - 1) % self.n_slots
+
+        version = self.versions[i]
+        if version % 2 == 1:
+            return None, last_seen
+
+        length = self.lengths[i]
+        shape = tuple(self.shapes[2 * i:2 * i + 2])
+        record = dict(
+            seed = self.seeds[i],
+            action = self._slot(i)[:length * int(np.prod(shape))].reshape(
+                (length,) + shape).copy()
+        )
+
+        if self.versions[i] != version:
+            return None, last_seen
+
+        return record, head
+
+    def stop(self):
+        self.stopped.value = 1
+
+# Global method take take a feed as input, wait for new episodes in the feed,
+# set the random seed, and replay those actions and render.
+def renderer(feed):
 
     env = None
+    last_seen = 0
 
-    while True:
+    while not feed.stopped.value:
         try:
-            rollout = q.get_nowait()
+            record, last_seen = feed.latest(last_seen)
+
+            if record is None:
+                # Nothing new to render, checking is cheap so don't wait long
+                time.sleep(0.5)
+                continue
 
             # env was initially set to None, because we start rendering only
             # after we receive data
             if env is None:
                 env = gym.make(FLAGS.game)
 
-            env.seed(rollout.seed[0])
+            env.seed(record["seed"])
             env.reset()
 
-            for action in rollout.action:
+            for action in record["action"]:
                 env.render()
                 env.step(action.T)
 
-        except Queue.Empty:
-            # Nothing in queue to render, wait 5 seconds ...
-            time.sleep(5)
-
         except Exception as e:
             tf.logging.info("\33[31m[Exception]\33[0m {}".format(e))
             raise e
 
 class Monitor(object):
+    """
+    Renders the latest episode of any worker in a separate process. Workers
+    publish (seed, actions) of every episode to self.feed, the main thread
+    doesn't need to do anything
+    """
     def __init__(self):
-        self.queue = multiprocessing.Manager().Queue(maxsize=5)
+        self.feed = EpisodeFeed()
         self.render_process = multiprocessing.Process(
-            target=renderer, args=(self.queue,))
-
-    def send(self, data):
-        try:
-            self.queue.put_nowait(data)
-        except:
-            pass
+            target=renderer, args=(self.feed,))
 
     def monitor(self, workers):
-        self.workers = workers
-        self.prev_data = [None] * len(workers)
-
-    def refresh(self):
-        # Iterate all workers and see whether there's new rollout to render
-        # We keep track the previous data we sent for each worker so that we
-        # won't render same rollout twice.
-        for i, worker in enumerate(self.workers):
-            if len(worker.replay_buffer) == 0:
-                continue
-
-            data = worker.replay_buffer[-1]
-            if self.prev_data[i] is data:
-                continue
+        for worker in workers:
+            worker.episode_feed = self.feed
 
-            self.send(data)
-            self.prev_data[i] = data
-    
     def start(self):
         self.render_process.start()
 
     def join(self):
+        self.feed.stop()
         self.render_process.join()
@@ -0,0 +1,149 @@
+import time
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict, deque
+FLAGS = tf.flags.FLAGS
+
+class NullSpan(object):
+    """
+    Returned by Profiler.span when profiling is disabled, so that instrumented
+    code costs only one attribute lookup and an empty with-statement.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class PhaseStats(object):
+    def __init__(self, path, maxlen, parent=None):
+        self.path = path
+        self.parent = parent
+        self.durations = deque(maxlen=maxlen)
+        self.count = 0
+        self.total = 0.
+
+    def add(self, duration):
+        self.durations.append(duration)
+        self.count += 1
+        self.total += duration
+
+    def reset_window(self):
+        self.count = 0
+        self.total = 0.
+
+class Span(object):
+    __slots__ = ('stack', 'stats', 't')
+
+    def __init__(self, stack, stats):
+        self.stack = stack
+        self.stats = stats
+
+    def __enter__(self):
+        self.stack.append(self.stats)
+        self.t = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.add(time.time() - self.t)
+        self.stack.pop()
+        return False
+
+class Profiler(object):
+    """
+    Per-worker wall-clock profiler. Instrument a phase of the training cycle
+    with
+
+        with self.profiler.span("simulation"):
+            env.step(action)
+
+    Durations of the last `maxlen` calls of every phase are kept to compute
+    percentiles. Every FLAGS.profile_every_n_seconds the profiler writes a log
+    line and TensorBoard scalars (when a summary_writer is given) showing how
+    much time each phase took and its share of the wall time since last report.
+
+    Spans opened inside another span are nested phases, named by their path
+    (e.g. "rollout/simulation"), and their share is of the parent's time, so
+    shares of siblings add up to at most 100%. A profiler must only be used
+    by one thread.
+    """
+    def __init__(self, name, enabled=None, maxlen=1000):
+        self.name = name
+        self.enabled = FLAGS.profile if enabled is None else enabled
+        self.maxlen = maxlen
+        self.phases = OrderedDict()
+        self.stack = []
+        self.last_report = time.time()
+
+    def span(self, phase):
+        if not self.enabled:
+            return NULL_SPAN
+
+        parent = self.stack[-1] if len(self.stack) > 0 else None
+        path = phase if parent is None else parent.path + "/" + phase
+
+        stats = self.phases.get(path)
+        if stats is None:
+            stats = self.phases[path] = PhaseStats(path, self.maxlen, parent)
+
+        return Span(self.stack, stats)
+
+    def add(self, phase, duration):
+        # Record a duration measured elsewhere (e.g. before profiler existed)
+        if phase not in self.phases:
+            self.phases[phase] = PhaseStats(phase, self.maxlen)
+        self.phases[phase].add(duration)
+
+    def stats(self):
+        window = max(time.time() - self.last_report, 1e-6)
+
+        stats = OrderedDict()
+        for phase, s in self.phases.iteritems():
+            if len(s.durations) == 0:
+                continue
+
+            # Share of parent's time for nested phases, of wall time otherwise
+            total = window if s.parent is None else max(s.parent.total, 1e-6)
+
+            durations = np.array(s.durations) * 1000
+            stats[phase] = dict(
+                mean_ms = np.mean(durations),
+                p50_ms = np.percentile(durations, 50),
+                p90_ms = np.percentile(durations, 90),
+                calls = s.count,
+                share = s.total / total,
+            )
+
+        return stats
+
+    def report(self, summary_writer=None, step=None):
+        stats = self.stats()
+
+        if len(stats) > 0:
+            tf.logging.info("\33[36m[profile {}]\33[0m ".format(self.name) + " | ".join([
+                "{} {:.2f}ms x{} ({:.0f}%)".format(
+                    phase, s['mean_ms'], s['calls'], s['share'] * 100)
+                for phase, s in stats.iteritems()
+            ]))
+
+        if summary_writer is not None and len(stats) > 0:
+            summary = tf.Summary()
+            for phase, s in stats.iteritems():
+                for key in ["mean_ms", "p50_ms", "p90_ms", "share"]:
+                    summary.value.add(
+                        tag="profile/{}/{}".format(phase, key), simple_value=s[key])
+            summary_writer.add_summary(summary, step)
+
+        for s in self.phases.itervalues():
+            s.reset_window()
+
+        self.last_report = time.time()
+
+    def maybe_report(self, summary_writer=None, step=None):
+        if not self.enabled:
+            return
+
+        if time.time() - self.last_report >= FLAGS.profile_every_n_seconds:
+            self.report(summary_writer, step)
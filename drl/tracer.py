@@ -0,0 +1,89 @@
+import tensorflow as tf
+from collections import defaultdict
+FLAGS = tf.flags.FLAGS
+
+def parse_steps(steps):
+    if not steps:
+        return []
+    return sorted([int(s) for s in steps.split(",") if s.strip()])
+
+class StepTracer(object):
+    """
+    Runs selected training steps with FULL_TRACE and dumps, into
+    FLAGS.debug_dir, a Chrome trace (open it in chrome://tracing) together with
+    a ranked text summary of op time aggregated by name scope.
+
+    Steps are given by --trace-steps. Since global_step is shared by all
+    workers, a step is traced by the first update that reaches it.
+    """
+    def __init__(self, name, steps=None):
+        self.name = name
+        self.pending = parse_steps(steps)
+        self.scopes = [s for s in FLAGS.trace_scopes.split(",") if s.strip()]
+
+    def should_trace(self, step):
+        return len(self.pending) > 0 and step >= self.pending[0]
+
+    def run_kwargs(self):
+        return dict(
+            options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            run_metadata=tf.RunMetadata()
+        )
+
+    def scope_of(self, node_name):
+        # Use the first known scope in the path, e.g. ops of Retrace live in
+        # worker_0/Q/Q_Retrace/while/..., so they are counted as "Q_Retrace"
+        for component in node_name.split("/"):
+            if component in self.scopes:
+                return component
+        return "other"
+
+    def aggregate(self, run_metadata):
+        by_scope = defaultdict(int)
+        by_op = defaultdict(int)
+
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                micros = node_stats.op_end_rel_micros - node_stats.op_start_rel_micros
+                by_scope[self.scope_of(node_stats.node_name)] += micros
+                by_op[node_stats.node_name] += micros
+
+        return by_scope, by_op
+
+    def format_summary(self, step, by_scope, by_op, top_n=30):
+        total = max(sum(by_scope.values()), 1)
+
+        lines = ["Trace of {} at global_step {}".format(self.name, step), ""]
+
+        lines.append("{:>10}  {:>6}  {}".format("time (ms)", "share", "scope"))
+        for scope, micros in sorted(by_scope.items(), key=lambda x: -x[1]):
+            lines.append("{:10.3f}  {:5.1f}%  {}".format(
+                micros / 1000., micros * 100. / total, scope))
+
+        lines += ["", "Top {} ops:".format(top_n)]
+        lines.append("{:>10}  {:>6}  {}".format("time (ms)", "share", "op"))
+        for op, micros in sorted(by_op.items(), key=lambda x: -x[1])[:top_n]:
+            lines.append("{:10.3f}  {:5.1f}%  {}".format(
+                micros / 1000., micros * 100. / total, op))
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, run_metadata, step):
+        from tensorflow.python.client import timeline
+
+        # All pending steps up to this one are considered traced
+        self.pending = [s for s in self.pending if s > step]
+
+        prefix = "{}/trace-{}-{}".format(FLAGS.debug_dir, self.name, step)
+
+        tl = timeline.Timeline(run_metadata.step_stats)
+        with open(prefix + ".json", "w") as f:
+            f.write(tl.generate_chrome_trace_format())
+
+        by_scope, by_op = self.aggregate(run_metadata)
+        summary = self.format_summary(step, by_scope, by_op)
+        with open(prefix + ".txt", "w") as f:
+            f.write(summary)
+
+        tf.logging.info("Step trace written to {}.{{json,txt}}\n{}".format(
+            prefix, "\n".join(summary.split("\n")[:12])))
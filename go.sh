@@ -7,7 +7,7 @@
   --max-global-steps 80000 \
   --estimator-type ACER \
   --log-file train.$(date +%s).log \
-  --stats-file train.$(date +%s).stats.csv \
+  --stats-file train.$(date +%s).stats \
   --parallelism 4 \
   --map-def map3 \
   --save-every-n-minutes 15 \
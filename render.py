@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Headless offline renderer for episodes recorded with --record-episodes.
+Episodes are replayed from (seed, actions) in a pool of worker processes and
+written to <exp-dir>/videos as videos (mp4) or frame arrays (npz):
+
+    python render.py --game OffRoadNav-v0 --exp my-exp --render-top-k 100
+
+Use the same --game/--exp (and env flags) as the training run. Episodes that
+are already rendered are skipped, so it can be re-run while training.
+"""
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+tf.flags.DEFINE_integer("render-processes", 4, "Maximum number of episodes rendered concurrently")
+tf.flags.DEFINE_integer("render-top-k", None, "Only render the k episodes with highest return. Default renders all")
+tf.flags.DEFINE_string("render-format", "mp4", "mp4 (needs OpenCV) or npz (raw RGB frames)")
+tf.flags.DEFINE_integer("render-fps", 20, "Frame rate of rendered videos")
+
+from drl.config import parse_flags
+FLAGS = parse_flags()
+
+import gym
+import gym_offroad_nav.envs
+from drl.ac.utils import load_episodes, mkdir_p
+
+# One env per renderer process, created once by the pool initializer
+env = None
+
+def init_renderer():
+    global env
+    env = gym.make(FLAGS.game)
+
+def episode_path(episode):
+    return os.path.join(FLAGS.videos_dir, "{}-{}-{:.2f}.{}".format(
+        episode.worker, episode.seed, episode.total_return, FLAGS.render_format))
+
+def write_video(fn, frames):
+    import cv2
+    H, W = frames.shape[1:3]
+    writer = cv2.VideoWriter(fn, cv2.VideoWriter_fourcc(*"mp4v"), FLAGS.render_fps, (W, H))
+    for frame in frames:
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+    writer.release()
+
+def render_episode(episode):
+    t = time.time()
+
+    env.seed(episode.seed)
+    env.reset()
+
+    frames = []
+    for action in episode.action:
+        frames.append(env.render(mode='rgb_array'))
+        env.step(action.T)
+    frames = np.stack(frames).astype(np.uint8)
+
+    fn = episode_path(episode)
+    tmp_fn = fn + ".tmp." + FLAGS.render_format
+    if FLAGS.render_format == "npz":
+        with open(tmp_fn, 'wb') as f:
+            np.savez_compressed(f, frames=frames)
+    else:
+        write_video(tmp_fn, frames)
+    os.rename(tmp_fn, fn)
+
+    return fn, len(frames), time.time() - t
+
+def main():
+    episodes = load_episodes(FLAGS.episodes_dir)
+    tf.logging.info("Found {} episodes in {}".format(len(episodes), FLAGS.episodes_dir))
+
+    if FLAGS.render_top_k is not None:
+        episodes = sorted(episodes, key=lambda e: -e.total_return)[:FLAGS.render_top_k]
+
+    episodes = [e for e in episodes if not os.path.exists(episode_path(e))]
+    if len(episodes) == 0:
+        return
+
+    mkdir_p(FLAGS.videos_dir)
+
+    tf.logging.info("Rendering {} episodes with {} processes ...".format(
+        len(episodes), FLAGS.render_processes))
+
+    pool = multiprocessing.Pool(FLAGS.render_processes, initializer=init_renderer)
+    try:
+        for i, (fn, n_frames, seconds) in enumerate(
+                pool.imap_unordered(render_episode, episodes)):
+            tf.logging.info("[{}/{}] {} ({} frames, {:.1f} s)".format(
+                i + 1, len(episodes), fn, n_frames, seconds))
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    main()
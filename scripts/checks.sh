@@ -0,0 +1,7 @@
+#!/bin/bash
+# Correctness checks, exits non-zero if any of them fails (usable as CI gate).
+# Run it from the repository root
+set -e
+
+python -m benchmarks.check_trust_region
+python -m benchmarks.check_sampling
@@ -31,7 +31,7 @@ M=000000
   --l2-reg 1e-4 \
   --parallelism 8 \
   --max-seq-length 256 \
-  --stats-file $(date +%s).stats.csv \
+  --stats-file $(date +%s).stats \
   --log-file $(date +%s).log \
   --summarize True \
   $@
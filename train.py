@@ -1,44 +1,86 @@
 #!/usr/bin/env python
-import colored_traceback.always
+import time
+startup_time = time.time()
 
 import os
 import sys
-import cv2
-import scipy.io
 import numpy as np
 import itertools
 import shutil
 import threading
-import time
-import schedule
 import tensorflow as tf
 from packaging import version
 assert version.parse(tf.__version__) > version.parse("1.0.0"), \
     "Tensorflow version >= 1.0.0 required"
 
+# Colorful traceback is only useful in interactive sessions, and sweeps
+# launching hundreds of short runs don't need to pay for importing it
+if sys.stderr.isatty():
+    import colored_traceback.always
+
 from drl.config import parse_flags
 
 FLAGS = parse_flags()
 
-import gym
-import gym_offroad_nav.envs
-
-from drl.monitor import Monitor
-# Show how each agent behaves in a seperate monitor thread
-monitor = Monitor()
-monitor.start()
-
-from drl.ac.estimators import get_estimator
-from drl.ac.worker import Worker
-from drl.ac.utils import save_model, write_statistics, EpisodeStats, warm_up_env
-warm_up_env()
+# Keep track of where startup time goes
+from drl.profiler import Profiler
+startup = Profiler("startup", enabled=True)
+startup.add("import_tf_and_parse_flags", time.time() - startup_time)
+startup.last_report = startup_time
+
+with startup.span("import_gym"):
+    import gym
+    import gym_offroad_nav.envs
+
+# Show how each agent behaves in a seperate monitor process. Skip it entirely
+# if there's nothing to display. It must be forked before tf.contrib is
+# imported (i.e. before drl.ac), otherwise env.render() breaks in the child,
+# so the episode feed is sized by flags only
+monitor = None
+if FLAGS.display:
+    with startup.span("start_monitor"):
+        from drl.monitor import Monitor
+        monitor = Monitor()
+        monitor.start()
+
+with startup.span("import_drl"):
+    from drl.ac.estimators import get_estimator
+    from drl.ac.worker import Worker
+    from drl.ac.utils import (
+        save_model, write_statistics, write_episodes, EpisodeStats,
+        EpisodeRecorder, initialize_env_related_flags, create_global_variables
+    )
+    from drl.checkpoint import CheckpointManager
+    from drl.graph_cache import export_training_graph, import_training_graph
+
+# Initialize env related flags using the env of worker_0 instead of creating
+# and closing an extra env
+with startup.span("init_env"):
+    env = gym.make(FLAGS.game)
+    initialize_env_related_flags(env)
 
 import multiprocessing
 tf.logging.info("Number of cpus = {}".format(multiprocessing.cpu_count()))
 
-# Optionally empty model directory
-if FLAGS.reset:
-    shutil.rmtree(FLAGS.base_dir, ignore_errors=True)
+# Evaluation processes are forked, so start them before creating any session
+evaluator = None
+if FLAGS.eval_every_n_minutes:
+    with startup.span("start_evaluator"):
+        from drl.evaluator import Evaluator
+        evaluator = Evaluator()
+
+# Optionally empty model directory. Keep the featurizer and graph caches
+# under FLAGS.cache_dir, which were possibly just written by this run, and
+# whose entries are keyed by everything they depend on anyway
+if FLAGS.reset and os.path.isdir(FLAGS.base_dir):
+    for name in os.listdir(FLAGS.base_dir):
+        path = os.path.join(FLAGS.base_dir, name)
+        if os.path.abspath(path) == os.path.abspath(FLAGS.cache_dir):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
 
 # Optionally empty model directory
 cfg = tf.ConfigProto()
@@ -48,74 +90,119 @@ with tf.Session(config=cfg) as sess:
     FLAGS.sess = sess
     FLAGS.stats = EpisodeStats()
 
-    # Keeps track of the number of updates we've performed
-    global_step = tf.Variable(0, name="global_step", trainable=False)
-    FLAGS.global_step = global_step
-
-    t = int(time.time())
-    global_time_init = tf.Variable(t, name="global_time_init", dtype=tf.int32, trainable=False)
-    global_time      = tf.Variable(t, name="global_time"     , dtype=tf.int32, trainable=False)
-    FLAGS.global_timestep_placeholder = tf.placeholder(tf.int32, [])
-    FLAGS.set_time_op = tf.assign(global_time, FLAGS.global_timestep_placeholder)
-
-    FLAGS.global_timestep = global_time - global_time_init
+    if FLAGS.record_episodes:
+        FLAGS.episode_recorder = EpisodeRecorder(FLAGS.episodes_dir)
 
     max_return = 0
 
-    # Get estimator class by type name
-    Estimator = get_estimator(FLAGS.estimator_type)
-
-    # Global policy and value nets
-    with tf.variable_scope("global_net"):
-        global_net = Estimator(trainable=False)
+    t = time.time()
 
     # Global step iterator
     global_counter = itertools.count()
 
-    # Create worker graphs
-    workers = []
-    for i in range(FLAGS.parallelism):
-        name = "worker_%d" % i
-        tf.logging.info("Initializing {} ...".format(name))
-
-        worker = Estimator.Worker(
-            name=name,
-            env=gym.make(FLAGS.game),
-            global_counter=global_counter,
-            global_episode_stats=FLAGS.stats,
-            global_net=global_net,
-            add_summaries=(i == 0),
-            n_agents=FLAGS.n_agents_per_worker)
-
-        workers.append(worker)
+    envs = [env] + [gym.make(FLAGS.game) for i in range(1, FLAGS.parallelism)]
+
+    # Try to reuse the graph of a previous run with the same graph flags. The
+    # average net (if any) is re-bound from the imported graph, so don't build
+    # it before importing
+    cached = None
+    if FLAGS.cache_graph:
+        Estimator = get_estimator(FLAGS.estimator_type, create_average_net=False)
+        cached = import_training_graph(Estimator, Worker)
+
+    if cached is not None:
+        global_net, workers = cached
+        for worker, worker_env in zip(workers, envs):
+            worker.init_runtime(
+                worker_env, global_counter, FLAGS.stats, FLAGS.n_agents_per_worker)
+    else:
+        # Average net reads global step and learning rate, create them first
+        create_global_variables()
+
+        # Get estimator class by type name
+        Estimator = get_estimator(FLAGS.estimator_type)
+
+        # Global policy and value nets. Workers use its summaries when they
+        # share it as local net
+        with tf.variable_scope("global_net"):
+            global_net = Estimator(add_summaries=FLAGS.share_local_net, trainable=False)
+
+        # Create worker graphs
+        workers = []
+        for i in range(FLAGS.parallelism):
+            name = "worker_%d" % i
+            tf.logging.info("Initializing {} ...".format(name))
+
+            worker = Estimator.Worker(
+                name=name,
+                env=envs[i],
+                global_counter=global_counter,
+                global_episode_stats=FLAGS.stats,
+                global_net=global_net,
+                add_summaries=(i == 0),
+                n_agents=FLAGS.n_agents_per_worker)
+
+            workers.append(worker)
+
+        if FLAGS.cache_graph:
+            export_training_graph(Estimator, global_net, workers)
+
+    global_step = FLAGS.global_step
+
+    startup.add("build_graph", time.time() - t)
 
     if FLAGS.summarize:
         tf.logging.info("Create summary writer ... (this takes a long time)")
-        summary_dir = os.path.join(FLAGS.exp_dir, "train")
-        summary_writer = tf.summary.FileWriter(summary_dir, sess.graph)
+        with startup.span("summary_writer"):
+            summary_dir = os.path.join(FLAGS.exp_dir, "train")
+            summary_writer = tf.summary.FileWriter(
+                summary_dir, sess.graph, max_queue=FLAGS.summary_max_queue,
+                flush_secs=FLAGS.summary_flush_secs)
         workers[0].summary_writer = summary_writer
 
-    tf.logging.info("Creating TensorFlow graph Saver ...")
-    FLAGS.saver = tf.train.Saver(max_to_keep=10, var_list=[
+    tf.logging.info("Creating checkpoint manager ...")
+    var_list = [
         v for v in tf.trainable_variables() if "worker" not in v.name
-    ] + [global_step])
+    ] + [global_step]
+    FLAGS.checkpoint_manager = CheckpointManager(
+        var_list, FLAGS.checkpoint_dir, max_to_keep=10)
+
+    # Only used to resume from checkpoints written by tf.train.Saver
+    FLAGS.saver = tf.train.Saver(var_list=var_list)
 
     tf.logging.info("Initializing all TensorFlow variables ...")
-    sess.run(tf.global_variables_initializer())
+    with startup.span("init_variables"):
+        sess.run(tf.global_variables_initializer())
+        FLAGS.learning_rate_var.load(FLAGS.learning_rate, sess)
     tf.get_default_graph().finalize()
 
-    # Save model and dump statistics every n minutes
-    schedule.every(FLAGS.save_every_n_minutes).minutes.do(save_model)
-    schedule.every(FLAGS.save_every_n_minutes).minutes.do(write_statistics)
-
     coord = tf.train.Coordinator()
 
     # Load a previous checkpoint if it exists
     if FLAGS.resume:
-        latest_checkpoint = tf.train.latest_checkpoint(FLAGS.checkpoint_dir)
+        latest_checkpoint = FLAGS.checkpoint_manager.latest_checkpoint()
         if latest_checkpoint:
             tf.logging.info("Loading model checkpoint: {}".format(latest_checkpoint))
-            FLAGS.saver.restore(sess, latest_checkpoint)
+            FLAGS.checkpoint_manager.restore(sess, latest_checkpoint)
+        else:
+            latest_checkpoint = tf.train.latest_checkpoint(FLAGS.checkpoint_dir)
+            if latest_checkpoint:
+                tf.logging.info("Loading model checkpoint: {}".format(latest_checkpoint))
+                FLAGS.saver.restore(sess, latest_checkpoint)
+
+    startup.report()
+    tf.logging.info("Startup took {:.2f} seconds".format(time.time() - startup_time))
+
+    # Save model and dump statistics every n minutes
+    import schedule
+    schedule.every(FLAGS.save_every_n_minutes).minutes.do(save_model)
+    schedule.every(FLAGS.save_every_n_minutes).minutes.do(write_statistics)
+    schedule.every(FLAGS.save_every_n_minutes).minutes.do(write_episodes)
+
+    if evaluator is not None:
+        schedule.every(FLAGS.eval_every_n_minutes).minutes.do(
+            evaluator.evaluate, sess, global_net.var_list, global_step,
+            workers[0].summary_writer)
 
     # Start worker threads
     worker_threads = []
@@ -128,22 +215,29 @@ with tf.Session(config=cfg) as sess:
             time.sleep(5)
         worker_threads.append(t)
 
-    monitor.monitor(workers)
+    if monitor is not None:
+        monitor.monitor(workers)
 
     while not Worker.stop:
-        if FLAGS.display:
-            monitor.refresh()
-
         time.sleep(1)
         schedule.run_pending()
 
     # Wait for threads and process to finish
     coord.join(worker_threads)
-    monitor.join()
+    if monitor is not None:
+        monitor.join()
+
+    if evaluator is not None:
+        evaluator.close()
+
+    if FLAGS.summarize:
+        summary_writer.close()
 
     # Save model and dump statistics to both file and screen
-    save_model()
+    save_model(block=True)
+    FLAGS.checkpoint_manager.close()
     write_statistics()
+    write_episodes()
     tf.logging.info(FLAGS.stats.summary())
 
 env.close()